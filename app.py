@@ -1,13 +1,44 @@
 
+import time
+# Every run of this script is timed from here (see the end of the file); in a
+# fresh process that includes the imports below.
+SCRIPT_STARTED = time.perf_counter()
+
 import streamlit as st
 import sqlite3
-import pandas as pd
+import queue
+import threading
+import collections
+import functools
+import inspect
+import asyncio
 import hashlib
-import time
-import requests
+import hmac
+import base64
+import socket
+import socketserver
+import urllib.parse
+import json
+import logging
+import os
+import zlib
+import html
+import re
+import unicodedata
 import io
-import PyPDF2
+import itertools
+import multiprocessing
+import tempfile
+import textwrap
+import numpy as np
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+# pandas, requests, PyPDF2 (through pdf_extract) and groq are imported inside
+# the functions that need them: together they are about a second of cold
+# start, and most sessions never open the pages that use them.
 
 # -----------------------------------------------------------------------------
 # CONFIGURATION & THEME
@@ -185,167 +216,1799 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# -----------------------------------------------------------------------------
+# METRICS
+# -----------------------------------------------------------------------------
+
+METRICS_RING_SIZE = 2048
+# Seconds between flushes of recorded samples to the metrics_samples table;
+# 0 keeps them in memory only.
+METRICS_FLUSH_INTERVAL = float(os.environ.get("RESEARCHHUB_METRICS_FLUSH", "0"))
+METRICS_RETENTION = 7 * 24 * 3600
+METRICS_PERCENTILES = (50, 95, 99)
+
+# Latency samples per metric name, the most recent METRICS_RING_SIZE of each,
+# shared by every session in the process. Recording is a perf_counter pair and
+# a deque append under a lock.
+class Metrics:
+    def __init__(self, size=METRICS_RING_SIZE, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.size = size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._pending = []
+        self._last_flush = time.time()
+
+    def record(self, name, seconds):
+        with self._lock:
+            ring = self._samples.get(name)
+            if ring is None:
+                ring = self._samples[name] = collections.deque(maxlen=self.size)
+            ring.append(seconds)
+            if not self.flush_interval:
+                return
+            self._pending.append((name, seconds, time.time()))
+            if time.time() - self._last_flush < self.flush_interval:
+                return
+            pending, self._pending = self._pending, []
+            self._last_flush = time.time()
+        self.flush(pending)
+
+    def flush(self, pending):
+        try:
+            with db_transaction() as conn:
+                conn.executemany("INSERT INTO metrics_samples (name, seconds, recorded_at) VALUES (?, ?, ?)", pending)
+                conn.execute("DELETE FROM metrics_samples WHERE recorded_at < ?", (time.time() - METRICS_RETENTION,))
+        except sqlite3.Error:
+            # Metrics must never break the request that produced them.
+            pass
+
+    def snapshot(self):
+        with self._lock:
+            samples = {name: np.array(ring) for name, ring in self._samples.items()}
+        return [summarize_samples(name, values) for name, values in sorted(samples.items())]
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+def summarize_samples(name, values):
+    row = {'name': name, 'count': len(values), 'mean_ms': values.mean() * 1000, 'max_ms': values.max() * 1000}
+    for p, v in zip(METRICS_PERCENTILES, np.percentile(values, METRICS_PERCENTILES)):
+        row[f'p{p}_ms'] = v * 1000
+    return row
+
+@st.cache_resource
+def get_metrics():
+    return Metrics()
+
+METRICS = get_metrics()
+log = logging.getLogger("researchhub")
+
+@contextmanager
+def timer(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        METRICS.record(name, time.perf_counter() - started)
+
+def timed(category):
+    # Decorator recording every call as "<category>.<function name>". For
+    # generator functions the clock runs until the caller finishes consuming.
+    def decorate(func):
+        name = f"{category}.{func.__name__}"
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with timer(name):
+                    yield from func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    METRICS.record(name, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
 # -----------------------------------------------------------------------------
 # DATABASE MANAGEMENT
 # -----------------------------------------------------------------------------
 
 DB_FILE = 'researchhub.db'
+# A file path for the embedded SQLite engine, or researchhub://host:port to use
+# a database server started with `python manage.py serve-db` (see below).
+# Replicas on one host can also share the file directly (WAL allows several
+# processes) if they set RESEARCHHUB_SHARED_CACHE=1 (see ReadCache).
+DB_URL = os.environ.get("RESEARCHHUB_DB", DB_FILE)
+DB_TOKEN = os.environ.get("RESEARCHHUB_DB_TOKEN", "")
+DB_POOL_SIZE = 8
+DB_BUSY_TIMEOUT = 10.0
+DB_STATEMENT_CACHE = 256
+DB_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -32000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+)
+TEXT_COMPRESS_LEVEL = 6
+
+# Paper bodies and chunk text are stored zlib-compressed. Every connection
+# registers inflate() so SQL (the FTS source view and its triggers) can read
+# them back.
+def compress_text(text):
+    return None if text is None else zlib.compress(text.encode('utf-8'), TEXT_COMPRESS_LEVEL)
+
+def decompress_text(blob):
+    return None if blob is None else zlib.decompress(blob).decode('utf-8')
+
+def connect_sqlite(db_file):
+    conn = sqlite3.connect(
+        db_file,
+        timeout=DB_BUSY_TIMEOUT,
+        cached_statements=DB_STATEMENT_CACHE,
+        check_same_thread=False,
+    )
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    conn.create_function("inflate", 1, decompress_text, deterministic=True)
+    return conn
+
+# Long-lived connections shared by every session. A thread keeps the connection
+# it checked out for the whole outermost block (nested data calls reuse it) and
+# hands it back to the pool afterwards, so statement caches stay warm. connect
+# is connect_sqlite or a RemoteConnection bound to a server address.
+class ConnectionPool:
+    def __init__(self, connect, size=DB_POOL_SIZE):
+        self._connect = connect
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._local = threading.local()
+
+    @contextmanager
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+
+        with self._slots:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            self._local.conn = conn
+            try:
+                yield conn
+            finally:
+                self._local.conn = None
+                if getattr(conn, 'broken', False):
+                    conn.close()  # a server connection that failed mid-call
+                else:
+                    if conn.in_transaction:
+                        conn.rollback()
+                    self._idle.put(conn)
+
+# numpy ints (ids read back through pandas) must bind as INTEGER, not BLOB.
+sqlite3.register_adapter(np.int64, int)
+sqlite3.register_adapter(np.int32, int)
+
+# ---- Database server ----
+# Several app processes (replicas behind a load balancer with sticky sessions,
+# possibly on other hosts) share one database through `manage.py serve-db`. The
+# server owns the SQLite file and gives every client socket its own connection,
+# so transactions behave exactly as with the embedded engine; RemoteConnection
+# implements the part of the sqlite3 connection API the data layer uses, and
+# errors come back as the same sqlite3 exception classes. Messages are JSON
+# lines, with BLOBs as {"$b": base64}. The server runs whatever SQL it is sent
+# (except ATTACH/DETACH), so it will not start without RESEARCHHUB_DB_TOKEN and
+# should still be bound to a private interface.
+DB_SERVER_PORT = 7411
+DB_SERVER_MAX_CLIENTS = 64
+
+def encode_value(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {'$b': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    return value
+
+def decode_value(value):
+    return base64.b64decode(value['$b']) if isinstance(value, dict) else value
+
+def encode_params(params):
+    if isinstance(params, dict):
+        return {k: encode_value(v) for k, v in params.items()}
+    return [encode_value(v) for v in params]
+
+def decode_params(params):
+    if isinstance(params, dict):
+        return {k: decode_value(v) for k, v in params.items()}
+    return [decode_value(v) for v in params]
+
+def parse_db_url(url):
+    # researchhub://host[:port] -> (host, port); anything else is a file path.
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme != "researchhub":
+        return None
+    return parts.hostname or "127.0.0.1", parts.port or DB_SERVER_PORT
+
+class RemoteCursor:
+    def __init__(self, reply):
+        self._rows = [tuple(map(decode_value, row)) for row in reply.get('rows', ())]
+        self._next = 0
+        self.lastrowid = reply.get('lastrowid')
+        self.rowcount = reply.get('rowcount', -1)
+
+    def fetchone(self):
+        if self._next >= len(self._rows):
+            return None
+        self._next += 1
+        return self._rows[self._next - 1]
+
+    def fetchall(self):
+        rows, self._next = self._rows[self._next:], len(self._rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+class RemoteConnection:
+    def __init__(self, address, token=DB_TOKEN):
+        self.broken = False
+        self.in_transaction = False
+        self._sock = socket.create_connection(address, timeout=DB_BUSY_TIMEOUT * 3)
+        self._file = self._sock.makefile('rwb')
+        self._call({'op': 'hello', 'token': token})
+
+    def _call(self, message):
+        try:
+            self._file.write(json.dumps(message).encode() + b"\n")
+            self._file.flush()
+            line = self._file.readline()
+            if not line:
+                raise ConnectionError("server closed the connection")
+        except OSError as e:
+            self.broken = True
+            self.in_transaction = False
+            raise sqlite3.OperationalError(f"database server unavailable: {e}") from e
+        reply = json.loads(line)
+        self.in_transaction = reply.get('in_transaction', False)
+        if 'error' in reply:
+            error = getattr(sqlite3, reply['error'], None)
+            if not (isinstance(error, type) and issubclass(error, sqlite3.Error)):
+                error = sqlite3.Error
+            raise error(reply['message'])
+        return reply
+
+    def execute(self, sql, params=()):
+        return RemoteCursor(self._call({'op': 'execute', 'sql': sql, 'params': encode_params(params)}))
+
+    def executemany(self, sql, seq_of_params):
+        return RemoteCursor(self._call({'op': 'executemany', 'sql': sql, 'params': [encode_params(p) for p in seq_of_params]}))
+
+    def commit(self):
+        self._call({'op': 'commit'})
+
+    def rollback(self):
+        if not self.broken:
+            self._call({'op': 'rollback'})
+
+    def close(self):
+        self.broken = True
+        try:
+            self._file.close()
+            self._sock.close()
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+class DatabaseRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        if not self.server.slots.acquire(blocking=False):
+            self.reply({'error': 'OperationalError', 'message': "too many database clients"})
+            return
+        conn = None
+        try:
+            for line in self.rfile:
+                message = json.loads(line)
+                if conn is None:
+                    token = message.get('token')
+                    if (message.get('op') != 'hello' or not isinstance(token, str) or not token
+                            or not hmac.compare_digest(token.encode(), self.server.token.encode())):
+                        self.reply({'error': 'OperationalError', 'message': "bad database token"})
+                        return
+                    conn = connect_sqlite(self.server.db_file)
+                    conn.set_authorizer(deny_attach)
+                    self.reply({})
+                    continue
+                try:
+                    reply = self.dispatch(conn, message)
+                except (sqlite3.Error, KeyError, TypeError) as e:
+                    reply = {'error': type(e).__name__, 'message': str(e)}
+                reply['in_transaction'] = conn.in_transaction
+                self.reply(reply)
+        except (OSError, ValueError):
+            pass  # client went away or sent garbage; drop it
+        finally:
+            if conn is not None:
+                conn.close()  # rolls back anything left open
+            self.server.slots.release()
+
+    def dispatch(self, conn, message):
+        op = message['op']
+        if op == 'execute':
+            cursor = conn.execute(message['sql'], decode_params(message['params']))
+            rows = [[encode_value(v) for v in row] for row in cursor.fetchall()]
+            return {'rows': rows, 'lastrowid': cursor.lastrowid, 'rowcount': cursor.rowcount}
+        if op == 'executemany':
+            cursor = conn.executemany(message['sql'], map(decode_params, message['params']))
+            return {'lastrowid': cursor.lastrowid, 'rowcount': cursor.rowcount}
+        if op == 'commit':
+            conn.commit()
+            return {}
+        if op == 'rollback':
+            conn.rollback()
+            return {}
+        raise sqlite3.ProgrammingError(f"unknown operation {op!r}")
+
+    def reply(self, message):
+        self.wfile.write(json.dumps(message).encode() + b"\n")
+        self.wfile.flush()
+
+# Clients may only touch the served file, never open or create others.
+def deny_attach(action, *args):
+    if action in (sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH):
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+class DatabaseServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, db_file=DB_FILE, token=DB_TOKEN, max_clients=DB_SERVER_MAX_CLIENTS):
+        if not token:
+            raise ValueError("the database server needs a token; set RESEARCHHUB_DB_TOKEN")
+        super().__init__(address, DatabaseRequestHandler)
+        self.db_file = db_file
+        self.token = token
+        self.slots = threading.BoundedSemaphore(max_clients)
+
+def db_connector(url):
+    address = parse_db_url(url)
+    if address is None:
+        return functools.partial(connect_sqlite, url)
+    return functools.partial(RemoteConnection, address)
+
+@st.cache_resource
+def get_pool():
+    return ConnectionPool(db_connector(DB_URL))
+
+@contextmanager
+def db_transaction():
+    with get_pool().connection() as conn:
+        with conn:
+            yield conn
+
+# Schema migrations, applied in order and tracked with PRAGMA user_version.
+# Append new entries; never edit one that has shipped. A step is either a SQL
+# string or a callable taking the connection.
+MIGRATIONS = [
+    (1, [
+        '''CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS workspaces (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            name TEXT NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS papers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            workspace_id INTEGER,
+            title TEXT NOT NULL,
+            authors TEXT,
+            abstract TEXT,
+            content TEXT,
+            source TEXT,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (workspace_id) REFERENCES workspaces (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS chats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            workspace_id INTEGER,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (workspace_id) REFERENCES workspaces (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS docs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            title TEXT NOT NULL,
+            content TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )''',
+    ]),
+    (2, [
+        # chats/papers are read by workspace in id order; the rowid is part of
+        # every index entry, so these also cover ORDER BY id and COUNT(*).
+        "CREATE INDEX IF NOT EXISTS idx_workspaces_user ON workspaces (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_papers_workspace ON papers (workspace_id)",
+        "CREATE INDEX IF NOT EXISTS idx_chats_workspace ON chats (workspace_id)",
+        "CREATE INDEX IF NOT EXISTS idx_docs_user ON docs (user_id, updated_at)",
+    ]),
+    (3, [
+        # External-content FTS5 index over papers: the index holds only the
+        # postings, the text itself stays in the papers table.
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS papers_fts USING fts5(
+            title, authors, abstract, content,
+            content='papers', content_rowid='id', tokenize='porter unicode61'
+        )''',
+        '''CREATE TRIGGER IF NOT EXISTS papers_fts_ai AFTER INSERT ON papers BEGIN
+            INSERT INTO papers_fts (rowid, title, authors, abstract, content)
+            VALUES (new.id, new.title, new.authors, new.abstract, new.content);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS papers_fts_ad AFTER DELETE ON papers BEGIN
+            INSERT INTO papers_fts (papers_fts, rowid, title, authors, abstract, content)
+            VALUES ('delete', old.id, old.title, old.authors, old.abstract, old.content);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS papers_fts_au AFTER UPDATE ON papers BEGIN
+            INSERT INTO papers_fts (papers_fts, rowid, title, authors, abstract, content)
+            VALUES ('delete', old.id, old.title, old.authors, old.abstract, old.content);
+            INSERT INTO papers_fts (rowid, title, authors, abstract, content)
+            VALUES (new.id, new.title, new.authors, new.abstract, new.content);
+        END''',
+        "INSERT INTO papers_fts (papers_fts) VALUES ('rebuild')",
+    ]),
+    (4, [
+        '''CREATE TABLE IF NOT EXISTS paper_chunks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            paper_id INTEGER NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            token_count INTEGER NOT NULL,
+            embedding BLOB NOT NULL,
+            FOREIGN KEY (paper_id) REFERENCES papers (id)
+        )''',
+        "CREATE INDEX IF NOT EXISTS idx_paper_chunks_paper ON paper_chunks (paper_id, chunk_index)",
+        '''CREATE TRIGGER IF NOT EXISTS papers_chunks_ad AFTER DELETE ON papers BEGIN
+            DELETE FROM paper_chunks WHERE paper_id = old.id;
+        END''',
+        lambda conn: backfill_paper_chunks(conn),
+    ]),
+    (5, [
+        lambda conn: repair_blob_ids(conn),
+    ]),
+    (6, [
+        '''CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )''',
+        "CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used)",
+    ]),
+    (7, [
+        '''CREATE TABLE IF NOT EXISTS paper_summaries (
+            paper_id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            insights TEXT NOT NULL,
+            token_count INTEGER NOT NULL,
+            model TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (paper_id) REFERENCES papers (id)
+        )''',
+        '''CREATE TRIGGER IF NOT EXISTS papers_summaries_ad AFTER DELETE ON papers BEGIN
+            DELETE FROM paper_summaries WHERE paper_id = old.id;
+        END''',
+    ]),
+    (8, [
+        '''CREATE TABLE IF NOT EXISTS ingest_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            workspace_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            pages_done INTEGER NOT NULL DEFAULT 0,
+            pages_total INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            paper_id INTEGER,
+            payload BLOB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (workspace_id) REFERENCES workspaces (id)
+        )''',
+        "CREATE INDEX IF NOT EXISTS idx_ingest_jobs_workspace ON ingest_jobs (workspace_id)",
+        "CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs (status)",
+    ]),
+    (9, [
+        "ALTER TABLE ingest_jobs ADD COLUMN page_stats TEXT",
+    ]),
+    (10, [
+        # Content-addressed paper bodies: papers keep their per-workspace
+        # metadata and point at one shared body (and its chunks and summary).
+        "DROP TRIGGER IF EXISTS papers_fts_ai",
+        "DROP TRIGGER IF EXISTS papers_fts_ad",
+        "DROP TRIGGER IF EXISTS papers_fts_au",
+        "DROP TABLE IF EXISTS papers_fts",
+        '''CREATE TABLE paper_bodies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sha256 TEXT NOT NULL,
+            arxiv_id TEXT,
+            content TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        "CREATE UNIQUE INDEX idx_paper_bodies_arxiv ON paper_bodies (arxiv_id) WHERE arxiv_id IS NOT NULL",
+        "CREATE UNIQUE INDEX idx_paper_bodies_sha256 ON paper_bodies (sha256) WHERE arxiv_id IS NULL",
+        '''CREATE TABLE papers_v10 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            workspace_id INTEGER,
+            title TEXT NOT NULL,
+            authors TEXT,
+            abstract TEXT,
+            body_id INTEGER NOT NULL,
+            source TEXT,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (workspace_id) REFERENCES workspaces (id),
+            FOREIGN KEY (body_id) REFERENCES paper_bodies (id)
+        )''',
+        '''CREATE TABLE body_chunks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            body_id INTEGER NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            token_count INTEGER NOT NULL,
+            embedding BLOB NOT NULL,
+            FOREIGN KEY (body_id) REFERENCES paper_bodies (id)
+        )''',
+        '''CREATE TABLE body_summaries (
+            body_id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            insights TEXT NOT NULL,
+            token_count INTEGER NOT NULL,
+            model TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (body_id) REFERENCES paper_bodies (id)
+        )''',
+        lambda conn: move_content_to_bodies(conn),
+        "DROP TABLE paper_chunks",
+        "DROP TABLE paper_summaries",
+        "DROP TABLE papers",
+        "ALTER TABLE papers_v10 RENAME TO papers",
+        "CREATE INDEX idx_papers_workspace ON papers (workspace_id)",
+        "CREATE UNIQUE INDEX idx_papers_workspace_body ON papers (workspace_id, body_id)",
+        "CREATE INDEX idx_papers_body ON papers (body_id)",
+        "CREATE INDEX idx_body_chunks_body ON body_chunks (body_id, chunk_index)",
+        # A body lives as long as some workspace references it.
+        '''CREATE TRIGGER papers_body_gc AFTER DELETE ON papers BEGIN
+            DELETE FROM paper_bodies WHERE id = old.body_id
+                AND NOT EXISTS (SELECT 1 FROM papers WHERE body_id = old.body_id);
+        END''',
+        '''CREATE TRIGGER paper_bodies_ad AFTER DELETE ON paper_bodies BEGIN
+            DELETE FROM body_chunks WHERE body_id = old.id;
+            DELETE FROM body_summaries WHERE body_id = old.id;
+        END''',
+        # The FTS index now reads through a view joining papers to bodies.
+        # Deletes run BEFORE the row goes so the old body text is still there.
+        '''CREATE VIEW papers_fts_source AS
+            SELECT p.id, p.title, p.authors, p.abstract, b.content
+            FROM papers p LEFT JOIN paper_bodies b ON b.id = p.body_id''',
+        '''CREATE VIRTUAL TABLE papers_fts USING fts5(
+            title, authors, abstract, content,
+            content='papers_fts_source', content_rowid='id', tokenize='porter unicode61'
+        )''',
+        '''CREATE TRIGGER papers_fts_ai AFTER INSERT ON papers BEGIN
+            INSERT INTO papers_fts (rowid, title, authors, abstract, content)
+            VALUES (new.id, new.title, new.authors, new.abstract,
+                    (SELECT content FROM paper_bodies WHERE id = new.body_id));
+        END''',
+        '''CREATE TRIGGER papers_fts_bd BEFORE DELETE ON papers BEGIN
+            INSERT INTO papers_fts (papers_fts, rowid, title, authors, abstract, content)
+            VALUES ('delete', old.id, old.title, old.authors, old.abstract,
+                    (SELECT content FROM paper_bodies WHERE id = old.body_id));
+        END''',
+        '''CREATE TRIGGER papers_fts_bu BEFORE UPDATE ON papers BEGIN
+            INSERT INTO papers_fts (papers_fts, rowid, title, authors, abstract, content)
+            VALUES ('delete', old.id, old.title, old.authors, old.abstract,
+                    (SELECT content FROM paper_bodies WHERE id = old.body_id));
+        END''',
+        '''CREATE TRIGGER papers_fts_au AFTER UPDATE ON papers BEGIN
+            INSERT INTO papers_fts (rowid, title, authors, abstract, content)
+            VALUES (new.id, new.title, new.authors, new.abstract,
+                    (SELECT content FROM paper_bodies WHERE id = new.body_id));
+        END''',
+        "INSERT INTO papers_fts (papers_fts) VALUES ('rebuild')",
+    ]),
+    (11, [
+        # Compress body and chunk text. The view and triggers reading the old
+        # column go first; SQLite refuses to drop a column they reference.
+        "DROP TRIGGER papers_fts_ai",
+        "DROP TRIGGER papers_fts_bd",
+        "DROP TRIGGER papers_fts_bu",
+        "DROP TRIGGER papers_fts_au",
+        "DROP VIEW papers_fts_source",
+        "ALTER TABLE paper_bodies ADD COLUMN content_z BLOB",
+        "ALTER TABLE paper_bodies ADD COLUMN content_chars INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE body_chunks ADD COLUMN text_z BLOB",
+        lambda conn: compress_stored_text(conn),
+        "ALTER TABLE paper_bodies DROP COLUMN content",
+        "ALTER TABLE body_chunks DROP COLUMN text",
+        '''CREATE VIEW papers_fts_source AS
+            SELECT p.id, p.title, p.authors, p.abstract, inflate(b.content_z) AS content
+            FROM papers p LEFT JOIN paper_bodies b ON b.id = p.body_id''',
+        '''CREATE TRIGGER papers_fts_ai AFTER INSERT ON papers BEGIN
+            INSERT INTO papers_fts (rowid, title, authors, abstract, content)
+            VALUES (new.id, new.title, new.authors, new.abstract,
+                    (SELECT inflate(content_z) FROM paper_bodies WHERE id = new.body_id));
+        END''',
+        '''CREATE TRIGGER papers_fts_bd BEFORE DELETE ON papers BEGIN
+            INSERT INTO papers_fts (papers_fts, rowid, title, authors, abstract, content)
+            VALUES ('delete', old.id, old.title, old.authors, old.abstract,
+                    (SELECT inflate(content_z) FROM paper_bodies WHERE id = old.body_id));
+        END''',
+        '''CREATE TRIGGER papers_fts_bu BEFORE UPDATE ON papers BEGIN
+            INSERT INTO papers_fts (papers_fts, rowid, title, authors, abstract, content)
+            VALUES ('delete', old.id, old.title, old.authors, old.abstract,
+                    (SELECT inflate(content_z) FROM paper_bodies WHERE id = old.body_id));
+        END''',
+        '''CREATE TRIGGER papers_fts_au AFTER UPDATE ON papers BEGIN
+            INSERT INTO papers_fts (rowid, title, authors, abstract, content)
+            VALUES (new.id, new.title, new.authors, new.abstract,
+                    (SELECT inflate(content_z) FROM paper_bodies WHERE id = new.body_id));
+        END''',
+        "INSERT INTO papers_fts (papers_fts) VALUES ('rebuild')",
+    ]),
+    (12, [
+        # Local arXiv metadata mirror, filled by `python manage.py load-arxiv`.
+        '''CREATE TABLE arxiv_mirror (
+            id INTEGER PRIMARY KEY,
+            arxiv_id TEXT NOT NULL UNIQUE,
+            title TEXT NOT NULL,
+            authors TEXT,
+            abstract TEXT,
+            categories TEXT,
+            updated TEXT
+        )''',
+        '''CREATE VIRTUAL TABLE arxiv_mirror_fts USING fts5(
+            title, authors, abstract,
+            content='arxiv_mirror', content_rowid='id', tokenize='porter unicode61'
+        )''',
+        '''CREATE TRIGGER arxiv_mirror_ai AFTER INSERT ON arxiv_mirror BEGIN
+            INSERT INTO arxiv_mirror_fts (rowid, title, authors, abstract)
+            VALUES (new.id, new.title, new.authors, new.abstract);
+        END''',
+        '''CREATE TRIGGER arxiv_mirror_ad AFTER DELETE ON arxiv_mirror BEGIN
+            INSERT INTO arxiv_mirror_fts (arxiv_mirror_fts, rowid, title, authors, abstract)
+            VALUES ('delete', old.id, old.title, old.authors, old.abstract);
+        END''',
+        '''CREATE TRIGGER arxiv_mirror_au AFTER UPDATE ON arxiv_mirror BEGIN
+            INSERT INTO arxiv_mirror_fts (arxiv_mirror_fts, rowid, title, authors, abstract)
+            VALUES ('delete', old.id, old.title, old.authors, old.abstract);
+            INSERT INTO arxiv_mirror_fts (rowid, title, authors, abstract)
+            VALUES (new.id, new.title, new.authors, new.abstract);
+        END''',
+    ]),
+    (13, [
+        # Rolling summary of each workspace's chat, covering messages up to
+        # and including upto_id. Keyset paging on chats.id needs no new index:
+        # idx_chats_workspace already orders entries by (workspace_id, rowid).
+        '''CREATE TABLE chat_summaries (
+            workspace_id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            upto_id INTEGER NOT NULL,
+            token_count INTEGER NOT NULL,
+            model TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (workspace_id) REFERENCES workspaces (id)
+        )''',
+    ]),
+    (14, [
+        # Chunk token counts predate the current estimate_tokens.
+        lambda conn: conn.executemany(
+            "UPDATE body_chunks SET token_count = ? WHERE id = ?",
+            ((estimate_tokens(decompress_text(text_z)), chunk_id) for chunk_id, text_z in conn.execute("SELECT id, text_z FROM body_chunks").fetchall()),
+        ),
+    ]),
+    (15, [
+        # Latency samples flushed from the in-process Metrics rings.
+        '''CREATE TABLE metrics_samples (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            seconds REAL NOT NULL,
+            recorded_at REAL NOT NULL
+        )''',
+        "CREATE INDEX idx_metrics_samples_name ON metrics_samples (name, recorded_at)",
+    ]),
+    (16, [
+        # ReadCache generations, when several processes share the database.
+        '''CREATE TABLE cache_generations (
+            scope TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL
+        ) WITHOUT ROWID''',
+    ]),
+]
+
+def move_content_to_bodies(conn):
+    # Oldest paper wins: it keeps its id, and its chunks and summary become the
+    # body's. Later copies of the same body in the same workspace are dropped.
+    # arXiv papers are the same body only if their ids match (see store_body).
+    bodies, seen = {}, set()
+    papers = conn.execute("SELECT id, workspace_id, title, authors, abstract, content, source, added_at FROM papers ORDER BY id").fetchall()
+    for paper_id, workspace_id, title, authors, abstract, content, source, added_at in papers:
+        digest, arxiv = content_hash(content), arxiv_id(source)
+        key = ('arxiv', arxiv) if arxiv else ('sha256', digest)
+        body_id = bodies.get(key)
+        if body_id is None:
+            body_id = conn.execute(
+                "INSERT INTO paper_bodies (sha256, arxiv_id, content) VALUES (?, ?, ?)",
+                (digest, arxiv, content),
+            ).lastrowid
+            bodies[key] = body_id
+            conn.execute(
+                "INSERT INTO body_chunks (body_id, chunk_index, text, token_count, embedding) SELECT ?, chunk_index, text, token_count, embedding FROM paper_chunks WHERE paper_id = ?",
+                (body_id, paper_id),
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO body_summaries (body_id, summary, insights, token_count, model, created_at) SELECT ?, summary, insights, token_count, model, created_at FROM paper_summaries WHERE paper_id = ?",
+                (body_id, paper_id),
+            )
+        if (workspace_id, body_id) in seen:
+            continue
+        seen.add((workspace_id, body_id))
+        conn.execute(
+            "INSERT INTO papers_v10 (id, workspace_id, title, authors, abstract, body_id, source, added_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (paper_id, workspace_id, title, authors, abstract, body_id, source, added_at),
+        )
+
+def compress_stored_text(conn):
+    conn.executemany(
+        "UPDATE paper_bodies SET content_z = ?, content_chars = ? WHERE id = ?",
+        ((compress_text(content), len(content or ""), body_id) for body_id, content in conn.execute("SELECT id, content FROM paper_bodies").fetchall()),
+    )
+    conn.executemany(
+        "UPDATE body_chunks SET text_z = ? WHERE id = ?",
+        ((compress_text(text), chunk_id) for chunk_id, text in conn.execute("SELECT id, text FROM body_chunks").fetchall()),
+    )
+
+def repair_blob_ids(conn):
+    # Workspace ids taken straight from a DataFrame are numpy int64, which
+    # sqlite3 used to store as 8-byte BLOBs; integer joins never matched them.
+    for table in ('papers', 'chats'):
+        rows = conn.execute(f"SELECT id, workspace_id FROM {table} WHERE typeof(workspace_id) = 'blob'").fetchall()
+        conn.executemany(
+            f"UPDATE {table} SET workspace_id = ? WHERE id = ?",
+            [(int.from_bytes(blob, 'little', signed=True), row_id) for row_id, blob in rows if len(blob) == 8],
+        )
 
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def apply_migrations(conn):
+    for version, steps in MIGRATIONS:
+        if version <= schema_version(conn):
+            continue
+        # IMMEDIATE takes the write lock up front, so a second process starting
+        # at the same time waits here and then sees the bumped version.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= schema_version(conn):
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+@st.cache_resource
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS workspaces (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        name TEXT NOT NULL,
-        description TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS papers (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        workspace_id INTEGER,
-        title TEXT NOT NULL,
-        authors TEXT,
-        abstract TEXT,
-        content TEXT,
-        source TEXT,
-        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (workspace_id) REFERENCES workspaces (id)
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS chats (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        workspace_id INTEGER,
-        role TEXT NOT NULL,
-        content TEXT NOT NULL,
-        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (workspace_id) REFERENCES workspaces (id)
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS docs (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        title TEXT NOT NULL,
-        content TEXT,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )''')
-    conn.commit()
-    conn.close()
-
-init_db()
+    with get_pool().connection() as conn:
+        apply_migrations(conn)
 
 # -----------------------------------------------------------------------------
 # AUTHENTICATION & DATA LAYERS
 # -----------------------------------------------------------------------------
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+# Reads return lists of these named tuples rather than DataFrames. Getters
+# take columns= to fetch only what the caller renders; fields left out of a
+# query are None.
+Workspace = collections.namedtuple('Workspace', 'id user_id name description created_at', defaults=(None,) * 5)
+Paper = collections.namedtuple('Paper', 'id workspace_id title authors abstract source added_at content_chars', defaults=(None,) * 8)
+Doc = collections.namedtuple('Doc', 'id user_id title content updated_at', defaults=(None,) * 5)
+ChatMessage = collections.namedtuple('ChatMessage', 'id role content', defaults=(None,) * 3)
+WorkspaceStats = collections.namedtuple('WorkspaceStats', 'workspace_id name paper_count chat_count last_activity')
+
+PAPER_COLUMNS = {
+    'id': 'p.id', 'workspace_id': 'p.workspace_id', 'title': 'p.title', 'authors': 'p.authors',
+    'abstract': 'p.abstract', 'source': 'p.source', 'added_at': 'p.added_at', 'content_chars': 'b.content_chars',
+}
+
+def fetch_rows(conn, row_type, sql, params=(), columns=None, expressions=None):
+    # sql has a {columns} placeholder for the select list; expressions maps a
+    # field to its SQL when that is not simply the field name.
+    columns = tuple(columns or row_type._fields)
+    if not set(columns) <= set(row_type._fields):
+        raise ValueError(f"unknown {row_type.__name__} columns: {set(columns) - set(row_type._fields)}")
+    select = ", ".join((expressions or {}).get(c, c) for c in columns)
+    cursor = conn.execute(sql.format(columns=select), params)
+    if columns == row_type._fields:
+        return list(map(row_type._make, cursor))
+    return [row_type(**dict(zip(columns, r))) for r in cursor]
+
+# Streamlit reruns every page on each widget interaction, so the reads below
+# are served from memory until a write touches their data. Every entry is
+# stored with the generation of the scopes it depends on, e.g. ("papers",
+# workspace_id); writers bump those generations after committing and the next
+# read misses. The generation is taken before loading, so a write racing a
+# load only costs a second miss, never a stale hit. Values are tuples of named
+# tuples, shared by all sessions and never mutated.
+#
+# When several processes write the same database (replicas on a database
+# server, or on one shared file), the generations live in the
+# cache_generations table instead, so a write in one replica invalidates the
+# others; each cached read then costs one small query instead of its own.
+READ_CACHE_MAX_ENTRIES = 1024
+READ_CACHE_SHARED = os.environ.get("RESEARCHHUB_SHARED_CACHE", "1" if parse_db_url(DB_URL) else "0") == "1"
+
+def scope_name(scope):
+    return ":".join(map(str, scope))
+
+class ReadCache:
+    def __init__(self, max_entries=READ_CACHE_MAX_ENTRIES, shared=READ_CACHE_SHARED):
+        self.max_entries = max_entries
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._generations = collections.Counter()
+        self.hits = 0
+        self.misses = 0
+
+    def generations(self, scopes):
+        if not self.shared:
+            with self._lock:
+                return tuple(self._generations[s] for s in scopes)
+        names = [scope_name(s) for s in scopes]
+        with get_pool().connection() as conn:
+            found = dict(conn.execute(
+                "SELECT scope, generation FROM cache_generations WHERE scope IN (SELECT value FROM json_each(?))",
+                (json.dumps(names),),
+            ))
+        return tuple(found.get(n, 0) for n in names)
+
+    def get(self, key, scopes, load):
+        generation = self.generations(scopes)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = load()
+        with self._lock:
+            self._entries[key] = (generation, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, *scopes):
+        if self.shared:
+            with db_transaction() as conn:
+                conn.executemany(
+                    '''INSERT INTO cache_generations (scope, generation) VALUES (?, 1)
+                       ON CONFLICT (scope) DO UPDATE SET generation = generation + 1''',
+                    [(scope_name(s),) for s in scopes],
+                )
+            return
+        with self._lock:
+            for scope in scopes:
+                self._generations[scope] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+@st.cache_resource
+def get_read_cache():
+    return ReadCache()
+
+READ_CACHE = get_read_cache()
+
+def cached_read(scopes):
+    # scopes(*args, **kwargs) lists the scopes a call's result depends on. The
+    # undecorated function stays reachable as .__wrapped__.
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__name__, args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                return func(*args, **kwargs)
+            return READ_CACHE.get(key, scopes(*args, **kwargs), lambda: func(*args, **kwargs))
+        return wrapper
+    return decorate
+
+# ---- Credentials ----
+# Passwords are stored as "scrypt$N$r$p$salt$key" or
+# "pbkdf2_sha256$iterations$salt$key" (salt and key base64) with a random salt
+# per user. Hashes from before this format (bare unsalted SHA-256 hex) and
+# hashes made with older cost settings still verify, and are replaced with
+# the current scheme on the next successful login. The KDF runs on a small
+# pool so a burst of logins occupies at most KDF_WORKERS cores (hashlib
+# releases the GIL while deriving) and never the threads rendering pages.
+PASSWORD_SCHEME = os.environ.get("RESEARCHHUB_PASSWORD_SCHEME", "scrypt")
+SCRYPT_N = int(os.environ.get("RESEARCHHUB_SCRYPT_N", 2 ** 14))
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = int(os.environ.get("RESEARCHHUB_PBKDF2_ITERATIONS", 600000))
+PASSWORD_SALT_BYTES = 16
+KDF_WORKERS = 2
+# Logins beyond this many in flight are turned away rather than queued.
+KDF_MAX_PENDING = 16
+LOGIN_FAILURE_LIMIT = 5
+LOGIN_FAILURE_WINDOW = 300
+
+class LoginThrottled(Exception):
+    pass
+
+def password_params():
+    if PASSWORD_SCHEME == "pbkdf2_sha256":
+        return PASSWORD_SCHEME, (PBKDF2_ITERATIONS,)
+    return "scrypt", (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+def derive_key(scheme, params, password, salt):
+    if scheme == "scrypt":
+        n, r, p = params
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=128 * r * (n + p + 2) + 2 ** 20, dklen=32)
+    if scheme == "pbkdf2_sha256":
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, params[0])
+    raise ValueError(f"unknown password scheme {scheme!r}")
 
+def hash_password(password):
+    scheme, params = password_params()
+    salt = os.urandom(PASSWORD_SALT_BYTES)
+    key = derive_key(scheme, params, password, salt)
+    return "$".join([scheme, *map(str, params), base64.b64encode(salt).decode(), base64.b64encode(key).decode()])
+
+# Returns (matches, should be rehashed).
+def check_password(password, stored):
+    if "$" not in stored:
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored), True
+    scheme, *params, salt, key = stored.split("$")
+    params = tuple(map(int, params))
+    derived = derive_key(scheme, params, password, base64.b64decode(salt))
+    return hmac.compare_digest(derived, base64.b64decode(key)), (scheme, params) != password_params()
+
+# Bounds KDF work in flight and counts failed logins per username; both are
+# per process, so with replicas each enforces its own share.
+class LoginLimiter:
+    def __init__(self, max_pending=KDF_MAX_PENDING, failure_limit=LOGIN_FAILURE_LIMIT, window=LOGIN_FAILURE_WINDOW):
+        self.failure_limit = failure_limit
+        self.window = window
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._failures = {}
+
+    def check(self, username):
+        now = time.monotonic()
+        with self._lock:
+            failures = self._failures.get(username)
+            while failures and now - failures[0] > self.window:
+                failures.popleft()
+            if failures and len(failures) >= self.failure_limit:
+                raise LoginThrottled(f"Too many failed attempts. Try again in {int(self.window - (now - failures[0])) + 1}s.")
+
+    def failed(self, username):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._failures) > 10000:
+                # Forget usernames whose failures have all expired.
+                self._failures = {u: f for u, f in self._failures.items() if f and now - f[-1] <= self.window}
+            self._failures.setdefault(username, collections.deque()).append(now)
+
+    def succeeded(self, username):
+        with self._lock:
+            self._failures.pop(username, None)
+
+    def run(self, func, *args):
+        if not self._pending.acquire(blocking=False):
+            raise LoginThrottled("Too many sign-ins right now. Try again in a few seconds.")
+        try:
+            return get_kdf_executor().submit(func, *args).result()
+        finally:
+            self._pending.release()
+
+@st.cache_resource
+def get_kdf_executor():
+    return ThreadPoolExecutor(max_workers=KDF_WORKERS, thread_name_prefix="kdf")
+
+@st.cache_resource
+def get_login_limiter():
+    return LoginLimiter()
+
+@st.cache_resource
+def get_dummy_password_hash():
+    # Checked against for unknown usernames so they cost as much as real ones.
+    return hash_password(os.urandom(PASSWORD_SALT_BYTES).hex())
+
+# Both raise LoginThrottled when the limiter turns the request away.
+@timed("auth")
 def register_user(username, password):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
+    with get_pool().connection() as conn:
+        if conn.execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone():
+            return False
+    stored = get_login_limiter().run(hash_password, password)
     try:
-        c.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hash_password(password)))
-        conn.commit()
+        with db_transaction() as conn:
+            conn.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, stored))
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
+@timed("auth")
 def authenticate_user(username, password):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT id FROM users WHERE username = ? AND password = ?", (username, hash_password(password)))
-    user = c.fetchone()
-    conn.close()
-    return user[0] if user else None
-
-def get_workspaces(user_id):
-    conn = sqlite3.connect(DB_FILE)
-    df = pd.read_sql_query("SELECT * FROM workspaces WHERE user_id = ?", conn, params=(user_id,))
-    conn.close()
-    return df
-
+    limiter = get_login_limiter()
+    limiter.check(username)
+    with get_pool().connection() as conn:
+        user = conn.execute("SELECT id, password FROM users WHERE username = ?", (username,)).fetchone()
+    stored = user[1] if user else get_dummy_password_hash()
+    matches, stale = limiter.run(check_password, password, stored)
+    if not (user and matches):
+        limiter.failed(username)
+        return None
+    limiter.succeeded(username)
+    if stale:
+        # Best effort: when the pool is saturated the login still succeeds and
+        # a later one migrates the hash.
+        try:
+            fresh = limiter.run(hash_password, password)
+        except LoginThrottled:
+            return user[0]
+        # Conditional on the old hash, so a concurrent password change wins.
+        with db_transaction() as conn:
+            conn.execute("UPDATE users SET password = ? WHERE id = ? AND password = ?", (fresh, user[0], stored))
+    return user[0]
+
+@cached_read(lambda user_id, columns=None: [("workspaces", user_id)])
+@timed("db")
+def get_workspaces(user_id, columns=None):
+    with get_pool().connection() as conn:
+        return tuple(fetch_rows(conn, Workspace, "SELECT {columns} FROM workspaces WHERE user_id = ? ORDER BY id", (user_id,), columns))
+
+@timed("db")
 def create_workspace(user_id, name, description):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("INSERT INTO workspaces (user_id, name, description) VALUES (?, ?, ?)", (user_id, name, description))
-    conn.commit()
-    conn.close()
-
+    with db_transaction() as conn:
+        conn.execute("INSERT INTO workspaces (user_id, name, description) VALUES (?, ?, ?)", (user_id, name, description))
+    READ_CACHE.invalidate(("workspaces", user_id))
+
+ARXIV_ID_RE = re.compile(r"arxiv\.org/abs/(.+?)(?:v\d+)?$")
+
+def arxiv_id(source):
+    match = ARXIV_ID_RE.search(source or "")
+    return match.group(1) if match else None
+
+def content_hash(content):
+    normalized = " ".join(unicodedata.normalize("NFKC", content or "").split())
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+def find_body(conn, digest, arxiv):
+    # arXiv results are matched by id only: their text is just the abstract,
+    # which may be revised and which different papers can share (withdrawal
+    # notices). Everything else matches by the hash of its normalized text.
+    if arxiv:
+        row = conn.execute("SELECT id FROM paper_bodies WHERE arxiv_id = ?", (arxiv,)).fetchone()
+    else:
+        row = conn.execute("SELECT id FROM paper_bodies WHERE sha256 = ? AND arxiv_id IS NULL", (digest,)).fetchone()
+    return row[0] if row else None
+
+def store_body(conn, title, abstract, content, source):
+    digest, arxiv = content_hash(content), arxiv_id(source)
+    body_id = find_body(conn, digest, arxiv)
+    if body_id is not None:
+        return body_id
+    # Another import of the same text may have committed since the lookup;
+    # the unique indexes turn that into a no-op and the second lookup finds it.
+    cur = conn.execute(
+        "INSERT INTO paper_bodies (sha256, arxiv_id, content_z, content_chars) VALUES (?, ?, ?, ?) ON CONFLICT DO NOTHING",
+        (digest, arxiv, compress_text(content), len(content or "")),
+    )
+    if not cur.rowcount:
+        return find_body(conn, digest, arxiv)
+    index_body_chunks(conn, cur.lastrowid, paper_text(title, abstract, content))
+    return cur.lastrowid
+
+@timed("db")
 def add_paper(workspace_id, title, authors, abstract, content, source):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("INSERT INTO papers (workspace_id, title, authors, abstract, content, source) VALUES (?, ?, ?, ?, ?, ?)", (workspace_id, title, authors, abstract, content, source))
-    conn.commit()
-    conn.close()
-
-def get_papers(workspace_id):
-    conn = sqlite3.connect(DB_FILE)
-    df = pd.read_sql_query("SELECT * FROM papers WHERE workspace_id = ?", conn, params=(workspace_id,))
-    conn.close()
-    return df
-
+    # Importing a paper the workspace already holds is a no-op that returns the
+    # existing id.
+    index = get_vector_index(workspace_id)
+    with db_transaction() as conn:
+        body_id = store_body(conn, title, abstract, content, source)
+        existing = conn.execute("SELECT id FROM papers WHERE workspace_id = ? AND body_id = ?", (workspace_id, body_id)).fetchone()
+        if existing is not None:
+            return existing[0]
+        cur = conn.execute(
+            "INSERT INTO papers (workspace_id, title, authors, abstract, body_id, source) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING",
+            (workspace_id, title, authors, abstract, body_id, source),
+        )
+        if not cur.rowcount:
+            # A concurrent import of the same paper won.
+            return conn.execute("SELECT id FROM papers WHERE workspace_id = ? AND body_id = ?", (workspace_id, body_id)).fetchone()[0]
+        vector = body_vector(conn, body_id)
+    # The index is only touched once the row is committed; if the process dies
+    # in between, the sync in get_vector_index picks the paper up.
+    if vector is not None:
+        index.append([cur.lastrowid], vector[None, :])
+    READ_CACHE.invalidate(("papers", workspace_id))
+    return cur.lastrowid
+
+@timed("db")
+def delete_paper(workspace_id, paper_id):
+    with db_transaction() as conn:
+        conn.execute("DELETE FROM papers WHERE id = ? AND workspace_id = ?", (paper_id, workspace_id))
+    get_vector_index(workspace_id).delete([paper_id])
+    READ_CACHE.invalidate(("papers", workspace_id))
+
+# Paper metadata only; bodies stay compressed in the database and are read
+# through their chunks (retrieval) or per body (summaries).
+@cached_read(lambda workspace_id, columns=None: [("papers", workspace_id)])
+@timed("db")
+def get_papers(workspace_id, columns=None):
+    # The bodies join is only paid for when content_chars is asked for.
+    join = "LEFT JOIN paper_bodies b ON b.id = p.body_id" if columns is None or 'content_chars' in columns else ""
+    with get_pool().connection() as conn:
+        return tuple(fetch_rows(conn, Paper, f"SELECT {{columns}} FROM papers p {join} WHERE p.workspace_id = ? ORDER BY p.id",
+                                (workspace_id,), columns, PAPER_COLUMNS))
+
+# One round trip for the Dashboard: per-workspace paper/chat counts and the time
+# of the latest activity. Every subquery is answered from the workspace_id
+# indexes, so cost follows the user's own data rather than the whole table.
+WORKSPACE_STATS_SQL = '''
+    SELECT w.id, w.name,
+           (SELECT COUNT(*) FROM papers p WHERE p.workspace_id = w.id) AS paper_count,
+           (SELECT COUNT(*) FROM chats c WHERE c.workspace_id = w.id) AS chat_count,
+           MAX(w.created_at,
+               COALESCE((SELECT p.added_at FROM papers p WHERE p.workspace_id = w.id ORDER BY p.id DESC LIMIT 1), ''),
+               COALESCE((SELECT c.timestamp FROM chats c WHERE c.workspace_id = w.id ORDER BY c.id DESC LIMIT 1), '')
+           ) AS last_activity
+    FROM workspaces w
+    WHERE w.user_id = ?
+    GROUP BY w.id
+'''
+
+# Depends on the user's workspace list and on the papers and chats of each.
+def workspace_stats_scopes(user_id):
+    workspaces = get_workspaces(user_id, columns=('id',))
+    return [("workspaces", user_id)] + [(kind, w.id) for w in workspaces for kind in ("papers", "chats")]
+
+@cached_read(workspace_stats_scopes)
+@timed("db")
+def get_workspace_stats(user_id):
+    with get_pool().connection() as conn:
+        rows = conn.execute(WORKSPACE_STATS_SQL, (user_id,)).fetchall()
+    return tuple(map(WorkspaceStats._make, rows))
+
+@timed("db")
 def save_chat(workspace_id, role, content):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("INSERT INTO chats (workspace_id, role, content) VALUES (?, ?, ?)", (workspace_id, role, content))
-    conn.commit()
-    conn.close()
-
-def get_chat_history(workspace_id):
-    conn = sqlite3.connect(DB_FILE)
-    df = pd.read_sql_query("SELECT role, content FROM chats WHERE workspace_id = ? ORDER BY id ASC", conn, params=(workspace_id,))
-    conn.close()
-    return df.to_dict('records')
-
-def get_docs(user_id):
-    conn = sqlite3.connect(DB_FILE)
-    df = pd.read_sql_query("SELECT * FROM docs WHERE user_id = ?", conn, params=(user_id,))
-    conn.close()
-    return df
-
+    with db_transaction() as conn:
+        conn.execute("INSERT INTO chats (workspace_id, role, content) VALUES (?, ?, ?)", (workspace_id, role, content))
+    READ_CACHE.invalidate(("chats", workspace_id))
+
+CHAT_PAGE_SIZE = 50
+
+# Returns (messages oldest first, whether older ones exist). By default that is
+# the latest page; before_id pages further back by keyset on chats.id, and
+# since_id returns everything from that id on (the window the user expanded).
+@cached_read(lambda workspace_id, *args, **kwargs: [("chats", workspace_id)])
+@timed("db")
+def get_chat_history(workspace_id, before_id=None, since_id=None, limit=CHAT_PAGE_SIZE):
+    with get_pool().connection() as conn:
+        if since_id is not None:
+            rows = conn.execute(
+                "SELECT id, role, content FROM chats WHERE workspace_id = ? AND id >= ? ORDER BY id",
+                (workspace_id, since_id),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT id, role, content FROM chats WHERE workspace_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (workspace_id, before_id if before_id is not None else 2 ** 63 - 1, limit),
+            ).fetchall()[::-1]
+        has_older = bool(rows) and conn.execute(
+            "SELECT EXISTS (SELECT 1 FROM chats WHERE workspace_id = ? AND id < ?)", (workspace_id, rows[0][0])
+        ).fetchone()[0] == 1
+    return tuple(map(ChatMessage._make, rows)), has_older
+
+@cached_read(lambda user_id, columns=None: [("docs", user_id)])
+@timed("db")
+def get_docs(user_id, columns=None):
+    with get_pool().connection() as conn:
+        return tuple(fetch_rows(conn, Doc, "SELECT {columns} FROM docs WHERE user_id = ? ORDER BY id", (user_id,), columns))
+
+@timed("db")
+def get_doc(user_id, doc_id):
+    with get_pool().connection() as conn:
+        rows = fetch_rows(conn, Doc, "SELECT {columns} FROM docs WHERE id = ? AND user_id = ?", (doc_id, user_id))
+    return rows[0] if rows else None
+
+@timed("db")
 def save_doc(user_id, doc_id, title, content):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    if doc_id:
-        c.execute("UPDATE docs SET title = ?, content = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND user_id = ?", (title, content, doc_id, user_id))
-    else:
-        c.execute("INSERT INTO docs (user_id, title, content) VALUES (?, ?, ?)", (user_id, title, content))
-    conn.commit()
-    conn.close()
+    with db_transaction() as conn:
+        if doc_id:
+            conn.execute("UPDATE docs SET title = ?, content = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND user_id = ?", (title, content, doc_id, user_id))
+        else:
+            conn.execute("INSERT INTO docs (user_id, title, content) VALUES (?, ?, ?)", (user_id, title, content))
+    READ_CACHE.invalidate(("docs", user_id))
+
+# -----------------------------------------------------------------------------
+# RETRIEVAL
+# -----------------------------------------------------------------------------
+
+CHUNK_WORDS = 220
+CHUNK_OVERLAP = 40
+EMBEDDING_DIM = 1024
+CONTEXT_TOKEN_BUDGET = 3000
+# Every candidate paper gets at least this much relevance weight, so papers
+# that match nothing (e.g. "summarize these") still share the budget evenly.
+RELEVANCE_FLOOR = 0.05
+STOPWORDS = frozenset(
+    "a an and are as at be been but by for from has have in into is it its of on or "
+    "such that the their then there these this to was were which will with we our".split()
+)
+
+TOKEN_RE = re.compile(r"[^\W\d_]+|\d+|[^\w\s]|_")
+
+def estimate_tokens(text):
+    # Approximates BPE tokenizers (Llama 3, GPT-4 class) on English prose:
+    # short words are one token, longer ones about one per four characters,
+    # digit runs split in threes and every punctuation mark counts alone.
+    tokens = 0
+    for piece in TOKEN_RE.findall(text):
+        if piece[0].isdigit():
+            tokens += (len(piece) + 2) // 3
+        elif len(piece) > 6:
+            tokens += (len(piece) + 3) // 4
+        else:
+            tokens += 1
+    return max(1, tokens)
+
+def clip_to_tokens(text, budget, separator="\n\n"):
+    # Keeps whole sections (in order) while they fit.
+    kept, used = [], 0
+    for section in text.split(separator):
+        cost = estimate_tokens(section)
+        if used + cost > budget:
+            break
+        kept.append(section)
+        used += cost
+    return separator.join(kept), used
+
+def chunk_text(text, size=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    words = text.split()
+    if not words:
+        return []
+    step = size - overlap
+    return [" ".join(words[i:i + size]) for i in range(0, max(len(words) - overlap, 1), step)]
+
+def embed_texts(texts):
+    # Signed feature hashing with sublinear term frequency: stateless, CPU-only
+    # and stable across processes (crc32, not the salted builtin hash()).
+    matrix = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        tokens = [t for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in STOPWORDS]
+        if not tokens:
+            continue
+        hashes = np.fromiter((zlib.crc32(t.encode()) for t in tokens), dtype=np.uint32, count=len(tokens))
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+        counts = np.bincount(hashes % EMBEDDING_DIM, weights=signs, minlength=EMBEDDING_DIM)
+        vec = np.sign(counts) * np.log1p(np.abs(counts))
+        norm = np.linalg.norm(vec)
+        if norm:
+            matrix[row] = vec / norm
+    return matrix
+
+def paper_text(title, abstract, content):
+    parts = [title or ""]
+    # arXiv imports store the abstract as content and uploads start with it.
+    if abstract and not (content or "").startswith(abstract):
+        parts.append(abstract)
+    parts.append(content or "")
+    return "\n".join(parts)
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+def chunk_rows(text):
+    chunks = chunk_text(text)
+    if not chunks:
+        return []
+    vectors = embed_texts(chunks).astype(np.float16)
+    return [(i, chunk, estimate_tokens(chunk), vectors[i].tobytes()) for i, chunk in enumerate(chunks)]
+
+def index_body_chunks(conn, body_id, text):
+    conn.executemany(
+        "INSERT INTO body_chunks (body_id, chunk_index, text_z, token_count, embedding) VALUES (?, ?, ?, ?, ?)",
+        [(body_id, i, compress_text(chunk), tokens, embedding) for i, chunk, tokens, embedding in chunk_rows(text)],
+    )
+
+def body_vector(conn, body_id):
+    # Paper-level vector for the similarity index: the mean of the body's chunk
+    # vectors, or None for a body without any text.
+    blobs = [r[0] for r in conn.execute("SELECT embedding FROM body_chunks WHERE body_id = ?", (body_id,))]
+    if not blobs:
+        return None
+    matrix = np.frombuffer(b"".join(blobs), dtype=np.float16).reshape(len(blobs), EMBEDDING_DIM)
+    return normalize_rows(matrix.astype(np.float32).mean(axis=0))
+
+def backfill_paper_chunks(conn):
+    # Migration 4 (pre-body schema): chunks were stored per paper.
+    for paper_id, title, abstract, content in conn.execute("SELECT id, title, abstract, content FROM papers").fetchall():
+        conn.executemany(
+            "INSERT INTO paper_chunks (paper_id, chunk_index, text, token_count, embedding) VALUES (?, ?, ?, ?, ?)",
+            [(paper_id, *row) for row in chunk_rows(paper_text(title, abstract, content))],
+        )
+
+# build_context lays each paper out as CONTEXT_HEADER followed by its excerpts
+# joined with EXCERPT_SEPARATOR; retrieve_chunks charges both against the budget.
+CONTEXT_HEADER = "Title: {}\nExcerpts:\n"
+EXCERPT_SEPARATOR = "\n...\n"
+
+# Splits token_budget across papers in proportion to their relevance (their
+# best chunk's score) and fills each share with that paper's best chunks; what
+# a paper cannot use goes to the best remaining chunks overall. A paper's first
+# chunk also pays for its header, every later one for a separator, so the text
+# build_context makes from the result stays within token_budget.
+@timed("db")
+def retrieve_chunks(query, paper_ids, token_budget=CONTEXT_TOKEN_BUDGET):
+    ids = json.dumps([int(i) for i in paper_ids])
+    with get_pool().connection() as conn:
+        rows = conn.execute(
+            '''SELECT c.id, c.chunk_index, c.token_count, c.embedding, p.id, p.title
+               FROM papers p JOIN body_chunks c ON c.body_id = p.body_id
+               WHERE p.id IN (SELECT value FROM json_each(?))''',
+            (ids,),
+        ).fetchall()
+        if not rows:
+            return []
+
+        matrix = np.frombuffer(b"".join(r[3] for r in rows), dtype=np.float16).reshape(len(rows), EMBEDDING_DIM)
+        scores = matrix.astype(np.float32) @ embed_texts([query])[0]
+        # Best match first; ties fall back to chunk order, so a paper with no
+        # matching chunk contributes its opening.
+        order = np.lexsort((np.array([r[1] for r in rows]), -scores))
+
+        relevance = {}
+        for i in order:
+            relevance.setdefault(rows[i][4], max(float(scores[i]), 0.0) + RELEVANCE_FLOOR)
+        total = sum(relevance.values())
+        shares = {pid: token_budget * r / total for pid, r in relevance.items()}
+
+        separator_tokens = estimate_tokens(EXCERPT_SEPARATOR)
+        picked, used, spent = {}, 0, dict.fromkeys(relevance, 0)
+        for fill_share in (True, False):
+            for i in order:
+                chunk_id, _, tokens, _, paper_id, title = rows[i]
+                if chunk_id in picked:
+                    continue
+                cost = tokens + (separator_tokens if spent[paper_id] else estimate_tokens(CONTEXT_HEADER.format(title)))
+                if used + cost > token_budget:
+                    continue
+                if fill_share and spent[paper_id] + cost > shares[paper_id]:
+                    continue
+                picked[chunk_id] = (float(scores[i]), paper_id, title)
+                spent[paper_id] += cost
+                used += cost
+
+        texts = conn.execute(
+            "SELECT id, chunk_index, text_z, token_count FROM body_chunks WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(picked)),),
+        ).fetchall()
+    return sorted(
+        ({'paper_id': picked[r[0]][1], 'title': picked[r[0]][2], 'chunk_index': r[1], 'text': decompress_text(r[2]),
+          'tokens': r[3], 'score': picked[r[0]][0]} for r in texts),
+        key=lambda c: -c['score'],
+    )
+
+@timed("llm")
+def build_context(prompt, context_papers, token_budget=CONTEXT_TOKEN_BUDGET):
+    paper_ids = shortlist_papers(prompt, context_papers)
+    chunks = retrieve_chunks(prompt, paper_ids, token_budget)
+
+    # Group excerpts per paper (best paper first), in reading order within it.
+    by_paper = {}
+    for c in chunks:
+        by_paper.setdefault(c['paper_id'], []).append(c)
+    sections = []
+    for paper_chunks in by_paper.values():
+        paper_chunks.sort(key=lambda c: c['chunk_index'])
+        excerpts = EXCERPT_SEPARATOR.join(c['text'] for c in paper_chunks)
+        sections.append(CONTEXT_HEADER.format(paper_chunks[0]['title']) + excerpts)
+    return "\n\n".join(sections)
+
+# -----------------------------------------------------------------------------
+# VECTOR INDEX
+# -----------------------------------------------------------------------------
+
+# Derived from body_chunks and rebuilt on demand, so each replica keeps its own
+# copy on local disk: appends from several processes to shared files would
+# interleave.
+VECTOR_DIR = os.environ.get("RESEARCHHUB_VECTOR_DIR", 'vectors')
+VECTOR_COMPACT_RATIO = 0.25
+VECTOR_SCAN_BLOCK = 65536
+RELATED_PAPERS_K = 5
+RETRIEVAL_CANDIDATE_PAPERS = 40
+
+# Paper vectors of one workspace as two append-only files: a float32 matrix
+# and the matching int64 paper ids. Both are memory-mapped, so opening an
+# index costs nothing and a search streams through the page cache. Deleted
+# rows get id -1 (a tombstone) and are dropped by compact() once they make up
+# VECTOR_COMPACT_RATIO of the file.
+class VectorIndex:
+    def __init__(self, path, dim=EMBEDDING_DIM):
+        self.vectors_path = path + '.f32'
+        self.ids_path = path + '.ids'
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._stamp = None
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._ids = np.empty(0, dtype=np.int64)
+        self.generation = None  # of ("papers", workspace) when last synced; see get_vector_index
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.ids_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def _refresh(self):
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return
+        self._stamp = stamp
+        if stamp is None:
+            self._vectors = np.empty((0, self.dim), dtype=np.float32)
+            self._ids = np.empty(0, dtype=np.int64)
+            return
+        ids = np.fromfile(self.ids_path, dtype=np.int64)
+        rows = min(len(ids), os.path.getsize(self.vectors_path) // (4 * self.dim))
+        self._ids = ids[:rows]
+        self._vectors = (np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, self.dim))
+                         if rows else np.empty((0, self.dim), dtype=np.float32))
+
+    def live_ids(self):
+        with self._lock:
+            self._refresh()
+            return self._ids[self._ids >= 0]
+
+    def append(self, ids, vectors):
+        with self._lock:
+            self._refresh()
+            fresh = ~np.isin(ids, self._ids)
+            if not fresh.any():
+                return
+            ids, vectors = np.asarray(ids)[fresh], np.asarray(vectors)[fresh]
+            os.makedirs(os.path.dirname(self.vectors_path) or '.', exist_ok=True)
+            # Vectors first: a reader sizes the index by the ids file, so it
+            # never sees an id without its vector.
+            with open(self.vectors_path, 'ab') as f:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            with open(self.ids_path, 'ab') as f:
+                f.write(np.asarray(ids, dtype=np.int64).tobytes())
+            self._stamp = None
+
+    def delete(self, ids):
+        with self._lock:
+            self._refresh()
+            rows = np.nonzero(np.isin(self._ids, ids))[0]
+            if not len(rows):
+                return
+            with open(self.ids_path, 'r+b') as f:
+                for row in rows:
+                    f.seek(int(row) * 8)
+                    f.write(np.int64(-1).tobytes())
+            self._stamp = None
+            self._refresh()
+            if np.count_nonzero(self._ids < 0) >= VECTOR_COMPACT_RATIO * len(self._ids):
+                self.compact()
+
+    def compact(self):
+        with self._lock:
+            self._refresh()
+            live = self._ids >= 0
+            self.rewrite(self._ids[live], np.asarray(self._vectors[live]))
+
+    def rewrite(self, ids, vectors):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.vectors_path) or '.', exist_ok=True)
+            np.ascontiguousarray(vectors, dtype=np.float32).tofile(self.vectors_path + '.tmp')
+            np.asarray(ids, dtype=np.int64).tofile(self.ids_path + '.tmp')
+            os.replace(self.vectors_path + '.tmp', self.vectors_path)
+            os.replace(self.ids_path + '.tmp', self.ids_path)
+            self._stamp = None
+
+    def vectors_for(self, ids):
+        with self._lock:
+            self._refresh()
+            rows = np.nonzero(np.isin(self._ids, ids))[0]
+            return self._ids[rows], np.asarray(self._vectors[rows])
+
+    def search(self, queries, k, allowed_ids=None):
+        # Cosine top-k for a batch of unit-length queries: one matrix product
+        # per block of rows, keeping a running top-k per query.
+        with self._lock:
+            self._refresh()
+            ids, vectors = self._ids, self._vectors
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(ids), VECTOR_SCAN_BLOCK):
+            block_ids = ids[start:start + VECTOR_SCAN_BLOCK]
+            scores = queries @ np.asarray(vectors[start:start + VECTOR_SCAN_BLOCK]).T
+            mask = block_ids < 0
+            if allowed_ids is not None:
+                mask |= ~np.isin(block_ids, allowed_ids)
+            scores[:, mask] = -np.inf
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            best_ids = np.concatenate([best_ids, np.broadcast_to(block_ids, scores.shape)], axis=1)
+            if best_scores.shape[1] > k:
+                top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, top, axis=1)
+                best_ids = np.take_along_axis(best_ids, top, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_ids = np.take_along_axis(best_ids, order, axis=1)
+        return [
+            [(int(i), float(score)) for i, score in zip(row_ids, row_scores) if score != -np.inf]
+            for row_ids, row_scores in zip(best_ids, best_scores)
+        ]
+
+def paper_vectors_from_chunks(conn, workspace_id):
+    rows = conn.execute(
+        '''SELECT p.id, c.embedding FROM papers p JOIN body_chunks c ON c.body_id = p.body_id
+           WHERE p.workspace_id = ? ORDER BY p.id''',
+        (workspace_id,),
+    ).fetchall()
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    chunk_ids = np.array([r[0] for r in rows], dtype=np.int64)
+    matrix = np.frombuffer(b"".join(r[1] for r in rows), dtype=np.float16).reshape(len(rows), EMBEDDING_DIM)
+    paper_ids, starts = np.unique(chunk_ids, return_index=True)
+    sums = np.add.reduceat(matrix.astype(np.float32), starts, axis=0)
+    return paper_ids, normalize_rows(sums)
+
+def get_vector_index(workspace_id):
+    # Ids arrive as numpy ints from DataFrames; normalize so every caller shares
+    # the same cached index (and lock) per workspace.
+    workspace_id = int(workspace_id)
+    index = load_vector_index(workspace_id)
+    # Rebuild from the stored chunk embeddings whenever the workspace's papers
+    # changed since the last check and the files disagree with the papers
+    # table: on first use in a process (e.g. after a crash mid-write) and after
+    # another replica added or deleted papers. This process's own writes
+    # already updated the files, so for them this is one id query.
+    generation = READ_CACHE.generations([("papers", workspace_id)])
+    if index.generation != generation:
+        with get_pool().connection() as conn:
+            db_ids = {r[0] for r in conn.execute(
+                "SELECT p.id FROM papers p WHERE p.workspace_id = ? AND EXISTS (SELECT 1 FROM body_chunks c WHERE c.body_id = p.body_id)",
+                (workspace_id,),
+            )}
+            if db_ids != set(index.live_ids().tolist()):
+                index.rewrite(*paper_vectors_from_chunks(conn, workspace_id))
+        index.generation = generation
+    return index
+
+@st.cache_resource
+def load_vector_index(workspace_id):
+    return VectorIndex(os.path.join(VECTOR_DIR, f"workspace_{workspace_id}"))
+
+def related_papers(workspace_id, paper_ids, k=RELATED_PAPERS_K):
+    index = get_vector_index(workspace_id)
+    found_ids, vectors = index.vectors_for(paper_ids)
+    if not len(found_ids):
+        return {}
+    hits = index.search(vectors, k + 1)
+    neighbours = {pid: [(i, score) for i, score in row if i != pid][:k] for pid, row in zip(found_ids.tolist(), hits)}
+    wanted = {i for row in neighbours.values() for i, _ in row}
+    with get_pool().connection() as conn:
+        titles = dict(conn.execute("SELECT id, title FROM papers WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(list(wanted)),)))
+    return {
+        pid: [{'paper_id': i, 'title': titles[i], 'score': score} for i, score in row if i in titles]
+        for pid, row in neighbours.items()
+    }
+
+def shortlist_papers(query, context_papers, limit=RETRIEVAL_CANDIDATE_PAPERS):
+    # Large workspaces: pick the most similar papers from the index first so
+    # chunk scoring only reads the embeddings of a bounded candidate set.
+    paper_ids = [p.id for p in context_papers]
+    if len(paper_ids) <= limit:
+        return paper_ids
+    by_workspace = {}
+    for p in context_papers:
+        by_workspace.setdefault(p.workspace_id, []).append(p.id)
+    query_vec = embed_texts([query])
+    hits = []
+    for workspace_id, ids in by_workspace.items():
+        hits.extend(get_vector_index(workspace_id).search(query_vec, limit, np.array(ids))[0])
+    hits.sort(key=lambda h: -h[1])
+    return [i for i, _ in hits[:limit]]
 
 # -----------------------------------------------------------------------------
 # AI ENGINE
 # -----------------------------------------------------------------------------
 
-def get_groq_response(messages, api_key, model="llama-3.3-70b-versatile"):
-    try:
-        from groq import Groq
-        
-        client = Groq(api_key=api_key)
+GROQ_MODEL = "llama-3.3-70b-versatile"
+MOCK_MODEL = "mock"
+LLM_TEMPERATURE = 0.7
+MOCK_LATENCY = 1.0
+MOCK_FIRST_TOKEN_DELAY = 0.2
+LLM_CACHE_TTL = 7 * 24 * 3600
+LLM_CACHE_MAX_ENTRIES = 5000
+LLM_CONCURRENCY = 20
+LLM_TIMEOUT = 60.0
+LLM_RETRIES = 2
+LLM_RETRY_BACKOFF = 1.0
+
+class LLMCacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+@st.cache_resource
+def get_llm_cache_stats():
+    return LLMCacheStats()
+
+def llm_cache_key(model, messages, temperature=LLM_TEMPERATURE):
+    payload = json.dumps({'model': model, 'temperature': temperature, 'messages': messages}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def llm_cache_get(key):
+    now = time.time()
+    with db_transaction() as conn:
+        row = conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row and now - row[1] > LLM_CACHE_TTL:
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            row = None
+        if row:
+            conn.execute("UPDATE llm_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+    get_llm_cache_stats().record(row is not None)
+    return row[0] if row else None
+
+def llm_cache_put(key, model, response):
+    now = time.time()
+    with db_transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, model, response, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+            (key, model, response, now, now),
+        )
+        conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - LLM_CACHE_TTL,))
+        # Least recently used entries go first once the cache is over size.
+        conn.execute(
+            "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (LLM_CACHE_MAX_ENTRIES,),
+        )
+
+def cached_completion(model, messages, complete, use_cache=True):
+    if not use_cache:
+        return complete()
+    key = llm_cache_key(model, messages)
+    cached = llm_cache_get(key)
+    if cached is not None:
+        return cached
+    response = complete()
+    llm_cache_put(key, model, response)
+    return response
+
+def cached_stream(model, messages, stream, use_cache=True):
+    if not use_cache:
+        yield from stream()
+        return
+    key = llm_cache_key(model, messages)
+    cached = llm_cache_get(key)
+    if cached is not None:
+        yield cached
+        return
+    pieces = []
+    for piece in stream():
+        pieces.append(piece)
+        yield piece
+    # Only reached when the stream ran to completion without raising.
+    llm_cache_put(key, model, "".join(pieces))
+
+# ---- Providers ----
+
+# A provider answers a message list, whole or streamed, as coroutines on the
+# shared LLM event loop; is_retryable() says which failures deserve another try.
+class LLMProvider:
+    name = None
+    model = None
+
+    async def complete(self, messages):
+        raise NotImplementedError
+
+    async def stream(self, messages):
+        raise NotImplementedError
+        yield
+
+    def is_retryable(self, error):
+        return isinstance(error, asyncio.TimeoutError)
+
+class GroqProvider(LLMProvider):
+    name = "groq"
+
+    def __init__(self, client, model=GROQ_MODEL):
+        self.client = client
+        self.model = model
 
-        chat_completion = client.chat.completions.create(
+    async def complete(self, messages):
+        completion = await self.client.chat.completions.create(
             messages=messages,
-            model=model,
-            temperature=0.7
+            model=self.model,
+            temperature=LLM_TEMPERATURE
         )
+        return completion.choices[0].message.content
 
-        return chat_completion.choices[0].message.content
-
-    except Exception as e:
-        return f"Groq API Error: {str(e)}"
+    async def stream(self, messages):
+        stream = await self.client.chat.completions.create(
+            messages=messages,
+            model=self.model,
+            temperature=LLM_TEMPERATURE,
+            stream=True
+        )
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
 
+    def is_retryable(self, error):
+        import groq
+        return super().is_retryable(error) or isinstance(error, (groq.APIConnectionError, groq.RateLimitError, groq.InternalServerError))
 
-def mock_llm_response(prompt, context=""):
-    time.sleep(1)
+def mock_llm_text(prompt):
     if "summarize" in prompt.lower():
         return f"**Summary**\n\nThe selected papers provide a comprehensive view on the topic. Key findings include improved model efficiency and robust evaluation metrics.\n(Mock AI Response)"
     elif "extract" in prompt.lower():
@@ -353,46 +2016,914 @@ def mock_llm_response(prompt, context=""):
     else:
         return f"This is a mock response to '{prompt}'. Connect an API key for real inference."
 
-def generate_ai_response(prompt, context_papers, api_key=None):
-    context_text = ""
-    for paper in context_papers:
-        context_text += f"Title: {paper['title']}\nAbstract: {paper['abstract']}\nContent: {paper['content'][:800]}\n\n"
-    
-    system_prompt = f"You are a helpful Research Assistant.\nCONTEXT:\n{context_text}"
-    
+# Local backend used without an API key, with model-like latency so batching
+# and streaming behave as they would against Groq.
+class MockProvider(LLMProvider):
+    name = "mock"
+    model = MOCK_MODEL
+
+    async def complete(self, messages):
+        await asyncio.sleep(MOCK_LATENCY)
+        return mock_llm_text(messages[-1]['content'])
+
+    async def stream(self, messages):
+        # Same text and total latency as complete(), delivered word by word.
+        pieces = re.findall(r"\s*\S+\s*", mock_llm_text(messages[-1]['content']))
+        await asyncio.sleep(MOCK_FIRST_TOKEN_DELAY)
+        for piece in pieces:
+            await asyncio.sleep((MOCK_LATENCY - MOCK_FIRST_TOKEN_DELAY) / len(pieces))
+            yield piece
+
+# ---- Runtime ----
+
+# One event loop on a daemon thread per process. Async HTTP clients stay bound
+# to the loop they first ran on, so every provider call is scheduled here and
+# the cached clients keep their connections across reruns and sessions. The
+# semaphore bounds requests in flight process-wide; each attempt gets
+# LLM_TIMEOUT (per piece when streaming) and retryable failures back off.
+class LLMRuntime:
+    def __init__(self, concurrency=LLM_CONCURRENCY):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="llm-loop", daemon=True).start()
+        self.semaphore = self._run(self._make_semaphore(concurrency))
+
+    async def _make_semaphore(self, concurrency):
+        return asyncio.Semaphore(concurrency)
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def _complete(self, provider, messages):
+        async with self.semaphore:
+            for attempt in range(LLM_RETRIES + 1):
+                try:
+                    return await asyncio.wait_for(provider.complete(messages), LLM_TIMEOUT)
+                except Exception as e:
+                    if attempt == LLM_RETRIES or not provider.is_retryable(e):
+                        raise
+                    await asyncio.sleep(LLM_RETRY_BACKOFF * 2 ** attempt)
+
+    async def _complete_many(self, provider, batch):
+        return await asyncio.gather(*(self._complete(provider, m) for m in batch), return_exceptions=True)
+
+    async def _pump(self, provider, messages, sink):
+        # A stream is only retried before its first piece reached the caller.
+        async with self.semaphore:
+            for attempt in range(LLM_RETRIES + 1):
+                started = False
+                try:
+                    pieces = provider.stream(messages)
+                    while True:
+                        try:
+                            piece = await asyncio.wait_for(pieces.__anext__(), LLM_TIMEOUT)
+                        except StopAsyncIteration:
+                            return
+                        started = True
+                        sink.put(piece)
+                except Exception as e:
+                    if started or attempt == LLM_RETRIES or not provider.is_retryable(e):
+                        raise
+                    await asyncio.sleep(LLM_RETRY_BACKOFF * 2 ** attempt)
+
+    def complete(self, provider, messages):
+        return self._run(self._complete(provider, messages))
+
+    def complete_many(self, provider, batch):
+        # The whole batch is in flight at once (up to the semaphore); failures
+        # come back in their slot as exception objects.
+        return self._run(self._complete_many(provider, batch))
+
+    def stream(self, provider, messages):
+        sink = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(self._pump(provider, messages, sink), self.loop)
+        future.add_done_callback(lambda f: sink.put(None))
+        try:
+            while (piece := sink.get()) is not None:
+                yield piece
+            future.result()
+        finally:
+            # The caller stopped early (or the rerun was interrupted).
+            future.cancel()
+
+@st.cache_resource
+def get_llm_runtime():
+    return LLMRuntime()
+
+@st.cache_resource
+def get_groq_client(api_key):
+    from groq import AsyncGroq
+    # Timeouts and retries are LLMRuntime's job.
+    return AsyncGroq(api_key=api_key, max_retries=0)
+
+def get_llm_provider(api_key=None, model=GROQ_MODEL):
     if api_key and api_key.strip() != "":
-        messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": prompt}]
-        return get_groq_response(messages, api_key)
+        return GroqProvider(get_groq_client(api_key.strip()), model)
+    return MockProvider()
+
+@timed("llm")
+def complete_batch(batch, api_key=None, model=GROQ_MODEL, use_cache=True):
+    # Answers many message lists concurrently. Cached answers are served
+    # directly; a request that still fails after retries leaves None.
+    provider = get_llm_provider(api_key, model)
+    keys = [llm_cache_key(provider.model, m) for m in batch]
+    results = [llm_cache_get(k) if use_cache else None for k in keys]
+    todo = [i for i, r in enumerate(results) if r is None]
+    replies = get_llm_runtime().complete_many(provider, [batch[i] for i in todo])
+    for i, reply in zip(todo, replies):
+        if isinstance(reply, BaseException):
+            continue
+        results[i] = reply
+        if use_cache:
+            llm_cache_put(keys[i], provider.model, reply)
+    return results
+
+@timed("llm")
+def groq_complete(messages, api_key, model=GROQ_MODEL):
+    return get_llm_runtime().complete(get_llm_provider(api_key, model), messages)
+
+@timed("llm")
+def groq_stream(messages, api_key, model=GROQ_MODEL):
+    yield from get_llm_runtime().stream(get_llm_provider(api_key, model), messages)
+
+def get_groq_response(messages, api_key, model=GROQ_MODEL, use_cache=True):
+    try:
+        return cached_completion(model, messages, lambda: groq_complete(messages, api_key, model), use_cache)
+    except Exception as e:
+        return f"Groq API Error: {str(e)}"
+
+def stream_groq_response(messages, api_key, model=GROQ_MODEL, use_cache=True):
+    try:
+        yield from cached_stream(model, messages, lambda: groq_stream(messages, api_key, model), use_cache)
+    except Exception as e:
+        yield f"Groq API Error: {str(e)}"
+
+
+# ---- Prompt assembly ----
+
+MODEL_CONTEXT_TOKENS = {GROQ_MODEL: 131072, MOCK_MODEL: 8192}
+RESPONSE_TOKEN_RESERVE = 1024
+SYSTEM_PREAMBLE = "You are a helpful Research Assistant."
+
+# Builds the message list for one request. The fixed parts (instructions,
+# conversation summary, recent turns, the question) are counted first; the
+# paper context gets what is left of the model's window, capped at
+# CONTEXT_TOKEN_BUDGET. chat_memory is (rolling summary, recent messages) from
+# get_chat_memory. Returns (messages, usage) with the token counts per part.
+@timed("llm")
+def assemble_prompt(prompt, context_papers, model, context_text=None, chat_memory=None):
+    summary, recent = chat_memory or ("", [])
+    history = [{"role": m.role, "content": m.content} for m in recent]
+    summary_block = f"\nCONVERSATION SO FAR:\n{summary}" if summary else ""
+
+    fixed = estimate_tokens(SYSTEM_PREAMBLE + summary_block) + estimate_tokens(prompt)
+    history_tokens = sum(estimate_tokens(m['content']) for m in history)
+    window = MODEL_CONTEXT_TOKENS.get(model, min(MODEL_CONTEXT_TOKENS.values()))
+    budget = max(0, min(CONTEXT_TOKEN_BUDGET, window - RESPONSE_TOKEN_RESERVE - fixed - history_tokens))
+
+    if context_text is None:
+        context_text = build_context(prompt, context_papers, budget)
+    context_text, context_tokens = clip_to_tokens(context_text, budget)
+
+    system_prompt = "".join((SYSTEM_PREAMBLE, "\nCONTEXT:\n", context_text, summary_block))
+    messages = [{"role": "system", "content": system_prompt}, *history, {"role": "user", "content": prompt}]
+    usage = {
+        'model': model,
+        'prompt_tokens': fixed + history_tokens + context_tokens,
+        'context_tokens': context_tokens,
+        'context_budget': budget,
+        'history_tokens': history_tokens,
+    }
+    return messages, usage
+
+def format_usage(usage):
+    return f"Prompt: {usage['prompt_tokens']:,} tokens (context {usage['context_tokens']:,} of {usage['context_budget']:,}, history {usage['history_tokens']:,})"
+
+# usage, when given, is filled with assemble_prompt's token counts.
+@timed("llm")
+def generate_ai_response(prompt, context_papers, api_key=None, use_cache=True, context_text=None, chat_memory=None, usage=None):
+    use_groq = bool(api_key and api_key.strip() != "")
+    messages, stats = assemble_prompt(prompt, context_papers, GROQ_MODEL if use_groq else MOCK_MODEL, context_text, chat_memory)
+    if usage is not None:
+        usage.update(stats)
+
+    if use_groq:
+        return get_groq_response(messages, api_key, use_cache=use_cache)
     else:
-        return mock_llm_response(prompt, context_text)
+        return cached_completion(MOCK_MODEL, messages, lambda: get_llm_runtime().complete(MockProvider(), messages), use_cache)
+
+@timed("llm")
+def generate_ai_response_stream(prompt, context_papers, api_key=None, use_cache=True, context_text=None, chat_memory=None, usage=None):
+    use_groq = bool(api_key and api_key.strip() != "")
+    messages, stats = assemble_prompt(prompt, context_papers, GROQ_MODEL if use_groq else MOCK_MODEL, context_text, chat_memory)
+    if usage is not None:
+        usage.update(stats)
+
+    if use_groq:
+        yield from stream_groq_response(messages, api_key, use_cache=use_cache)
+    else:
+        yield from cached_stream(MOCK_MODEL, messages, lambda: get_llm_runtime().stream(MockProvider(), messages), use_cache)
 
 # -----------------------------------------------------------------------------
-# SEARCH ENGINE
+# PAPER PIPELINE
 # -----------------------------------------------------------------------------
 
-def search_arxiv(query, max_results=5):
-    base_url = "http://export.arxiv.org/api/query?"
-    search_query = f"search_query=all:{query}&start=0&max_results={max_results}"
+PIPELINE_WORKERS = 4
+SUMMARY_INPUT_CHARS = 24000
+SUMMARY_SENTENCES = 3
+SUMMARY_SENTENCE_CHARS = 400
+SUMMARY_MAX_CHARS = 1000
+INSIGHT_SENTENCES = 4
+SUMMARY_PROMPT = (
+    "Summarize the research paper below in one paragraph, then list its key insights. "
+    'Reply with JSON only: {"summary": "...", "insights": ["...", "..."]}'
+)
+
+@st.cache_resource
+def get_pipeline_executor():
+    return ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="paper-pipeline")
+
+# Nobody waits on pipeline futures, so their errors are logged here and
+# counted as "failed.<task>" on the Performance page.
+def submit_background(func, *args):
+    future = get_pipeline_executor().submit(func, *args)
+    future.add_done_callback(functools.partial(report_background_failure, func.__name__))
+    return future
+
+def report_background_failure(name, future):
+    error = None if future.cancelled() else future.exception()
+    if error is not None:
+        log.error("background task %s failed", name, exc_info=error)
+        METRICS.record(f"failed.{name}", 0.0)
+
+def split_sentences(text):
+    return [s.strip() for s in re.split(r"(?<=[.!?])\s+|\n+", text) if len(s.split()) >= 5]
+
+def extractive_summary(text):
+    # Offline fallback: rank sentences by similarity to the paper's centroid,
+    # keep the best few in reading order as the summary and the next as insights.
+    # Runs without sentence punctuation (tables, extraction debris) are wrapped
+    # into SUMMARY_SENTENCE_CHARS pieces so no pick can be arbitrarily long.
+    sentences = [piece for s in split_sentences(text[:SUMMARY_INPUT_CHARS]) for piece in textwrap.wrap(s, SUMMARY_SENTENCE_CHARS)]
+    if not sentences:
+        return text[:500], []
+    vectors = embed_texts(sentences)
+    scores = vectors @ normalize_rows(vectors.sum(axis=0))
+    ranked = list(np.argsort(-scores))
+    summary = " ".join(sentences[i] for i in sorted(ranked[:SUMMARY_SENTENCES]))[:SUMMARY_MAX_CHARS]
+    insights = [sentences[i] for i in ranked[SUMMARY_SENTENCES:SUMMARY_SENTENCES + INSIGHT_SENTENCES]]
+    return summary, insights
+
+def summary_messages(title, text):
+    return [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": f"Title: {title}\n\n{text[:SUMMARY_INPUT_CHARS]}"},
+    ]
+
+def parse_summary_reply(reply):
     try:
-        response = requests.get(base_url + search_query)
-        import xml.etree.ElementTree as ET
-        root = ET.fromstring(response.content)
-        ns = {'atom': 'http://www.w3.org/2005/Atom'}
-        papers = []
-        for entry in root.findall('atom:entry', ns):
-            title = entry.find('atom:title', ns).text.strip().replace('\n', ' ')
-            summary = entry.find('atom:summary', ns).text.strip().replace('\n', ' ')
-            authors = [a.find('atom:name', ns).text for a in entry.findall('atom:author', ns)]
-            link = entry.find('atom:id', ns).text
-            papers.append({'title': title, 'abstract': summary, 'authors': ", ".join(authors), 'source': link, 'content': summary})
+        data = json.loads(reply[reply.index("{"):reply.rindex("}") + 1])
+        return str(data["summary"]), [str(i) for i in data["insights"]]
+    except (AttributeError, ValueError, KeyError, TypeError):
+        return None
+
+@timed("pipeline")
+def summarize_papers(paper_ids, api_key=None):
+    # Summaries belong to the shared body, so a paper already summarized in
+    # another workspace costs nothing here. All model calls go out as one
+    # concurrent batch; anything the model fails on falls back to extractive.
+    # With a key, extractive summaries (made offline or after a failed call)
+    # count as missing and are redone.
+    use_model = bool(api_key and api_key.strip() != "")
+    with get_pool().connection() as conn:
+        rows = conn.execute(
+            '''SELECT b.id, p.title, p.abstract, b.content_z FROM papers p JOIN paper_bodies b ON b.id = p.body_id
+               WHERE p.id IN (SELECT value FROM json_each(?))
+                 AND NOT EXISTS (SELECT 1 FROM body_summaries s WHERE s.body_id = b.id AND (s.model != 'extractive' OR NOT ?))
+               GROUP BY b.id''',
+            (json.dumps([int(i) for i in paper_ids]), use_model),
+        ).fetchall()
+    pending = [(body_id, title, paper_text("", abstract, decompress_text(content_z)).strip()) for body_id, title, abstract, content_z in rows]
+    if not pending:
+        return
+
+    replies = [None] * len(pending)
+    if use_model:
+        replies = complete_batch([summary_messages(title, text) for _, title, text in pending], api_key)
+
+    stored = []
+    for (body_id, title, text), reply in zip(pending, replies):
+        result, model = parse_summary_reply(reply), GROQ_MODEL
+        if result is None:
+            result, model = extractive_summary(text), "extractive"
+        summary, insights = result
+        stored.append((body_id, summary, json.dumps(insights), estimate_tokens(text), model))
+
+    with db_transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO body_summaries (body_id, summary, insights, token_count, model) VALUES (?, ?, ?, ?, ?)",
+            stored,
+        )
+
+def process_paper(paper_id, api_key=None):
+    summarize_papers([paper_id], api_key)
+
+def enqueue_paper_pipeline(paper_id, api_key=None):
+    return submit_background(process_paper, paper_id, api_key)
+
+def import_paper(workspace_id, title, authors, abstract, content, source, api_key=None):
+    paper_id = add_paper(workspace_id, title, authors, abstract, content, source)
+    enqueue_paper_pipeline(paper_id, api_key)
+    return paper_id
+
+@timed("db")
+def get_paper_summaries(paper_ids):
+    with get_pool().connection() as conn:
+        rows = conn.execute(
+            '''SELECT p.id, s.summary, s.insights, s.token_count, s.model
+               FROM papers p JOIN body_summaries s ON s.body_id = p.body_id
+               WHERE p.id IN (SELECT value FROM json_each(?))''',
+            (json.dumps([int(i) for i in paper_ids]),),
+        ).fetchall()
+    return {r[0]: {'summary': r[1], 'insights': json.loads(r[2]), 'token_count': r[3], 'model': r[4]} for r in rows}
+
+def ensure_paper_summaries(paper_ids, api_key=None):
+    # Map step: anything the background pipeline has not produced yet (papers
+    # imported before it existed, or still queued) is computed now, as one
+    # concurrent batch. With a key, extractive ones are upgraded the same way.
+    use_model = bool(api_key and api_key.strip() != "")
+    summaries = get_paper_summaries(paper_ids)
+    missing = [int(pid) for pid in paper_ids
+               if int(pid) not in summaries or (use_model and summaries[int(pid)]['model'] == "extractive")]
+    if missing:
+        summarize_papers(missing, api_key)
+        summaries.update(get_paper_summaries(missing))
+    return summaries
+
+def build_summary_context(papers, summaries):
+    sections = []
+    for p in papers:
+        s = summaries.get(p.id)
+        if s is None:
+            continue
+        insights = "\n".join(f"- {i}" for i in s['insights'])
+        sections.append(f"Title: {p.title}\nSummary: {s['summary']}\nKey insights:\n{insights}")
+    return "\n\n".join(sections)
+
+# -----------------------------------------------------------------------------
+# CHAT MEMORY
+# -----------------------------------------------------------------------------
+
+CHAT_CONTEXT_MESSAGES = 6
+CHAT_HISTORY_TOKEN_BUDGET = 1200
+CHAT_SUMMARY_BATCH = 10
+CHAT_SUMMARY_MAX_FOLD = 100
+CHAT_SUMMARY_TOKENS = 400
+CHAT_LINE_CHARS = 240
+CHAT_SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a researcher and an AI assistant. "
+    "Merge the new messages into the existing summary. Keep questions asked, answers given, papers "
+    f"and decisions mentioned. Stay under {CHAT_SUMMARY_TOKENS * 3 // 4} words. Reply with the summary only."
+)
+
+@timed("db")
+def get_chat_memory(workspace_id):
+    # What the model sees of the conversation: the rolling summary plus every
+    # message it does not cover yet, newest kept first within the budget. The
+    # fold (update_chat_summary) waits for CHAT_SUMMARY_BATCH messages beyond
+    # the last CHAT_CONTEXT_MESSAGES, so up to both together are unfolded.
+    with get_pool().connection() as conn:
+        row = conn.execute("SELECT summary, upto_id FROM chat_summaries WHERE workspace_id = ?", (workspace_id,)).fetchone()
+        summary, upto_id = row if row else ("", 0)
+        rows = conn.execute(
+            "SELECT role, content FROM chats WHERE workspace_id = ? AND id > ? ORDER BY id DESC LIMIT ?",
+            (workspace_id, upto_id, CHAT_CONTEXT_MESSAGES + CHAT_SUMMARY_BATCH),
+        ).fetchall()
+    recent, used = [], 0
+    for role, content in rows:
+        used += estimate_tokens(content)
+        if used > CHAT_HISTORY_TOKEN_BUDGET and recent:
+            break
+        recent.append(ChatMessage(role=role, content=content))
+    return summary, recent[::-1]
+
+def compact_summary(summary, messages):
+    # Offline fold: one line per message (its opening, clipped), dropping the
+    # oldest lines once the summary outgrows its budget.
+    lines = summary.splitlines() if summary else []
+    for role, content in messages:
+        first = (split_sentences(content) or [" ".join(content.split())])[0]
+        lines.append(f"{'User' if role == 'user' else 'Assistant'}: {first[:CHAT_LINE_CHARS]}")
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > CHAT_SUMMARY_TOKENS:
+        lines.pop(0)
+    return "\n".join(lines)
+
+def llm_chat_summary(summary, messages, api_key):
+    transcript = "\n".join(f"{role}: {content}" for role, content in messages)
+    reply = get_groq_response([
+        {"role": "system", "content": CHAT_SUMMARY_PROMPT},
+        {"role": "user", "content": f"Existing summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript[:SUMMARY_INPUT_CHARS]}"},
+    ], api_key)
+    return None if reply.startswith("Groq API Error") else reply.strip()
+
+@timed("pipeline")
+def update_chat_summary(workspace_id, api_key=None):
+    # Folds messages that have scrolled out of the verbatim window into the
+    # summary, in batches, so each reply costs at most one small fold.
+    while True:
+        with get_pool().connection() as conn:
+            row = conn.execute("SELECT summary, upto_id FROM chat_summaries WHERE workspace_id = ?", (workspace_id,)).fetchone()
+            summary, upto_id = row if row else ("", 0)
+            pending = conn.execute(
+                "SELECT id, role, content FROM chats WHERE workspace_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (workspace_id, upto_id, CHAT_SUMMARY_MAX_FOLD + CHAT_CONTEXT_MESSAGES),
+            ).fetchall()
+        fold = pending[:-CHAT_CONTEXT_MESSAGES]
+        if len(fold) < CHAT_SUMMARY_BATCH:
+            return
+        messages = [(role, content) for _, role, content in fold]
+
+        new_summary, model = None, "extractive"
+        if api_key and api_key.strip() != "":
+            new_summary, model = llm_chat_summary(summary, messages, api_key), GROQ_MODEL
+        if new_summary is None:
+            new_summary, model = compact_summary(summary, messages), "extractive"
+
+        with db_transaction() as conn:
+            # Only move forward: a concurrent fold that got further wins.
+            conn.execute(
+                '''INSERT INTO chat_summaries (workspace_id, summary, upto_id, token_count, model) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (workspace_id) DO UPDATE SET
+                       summary = excluded.summary, upto_id = excluded.upto_id, token_count = excluded.token_count,
+                       model = excluded.model, updated_at = CURRENT_TIMESTAMP
+                   WHERE chat_summaries.upto_id < excluded.upto_id''',
+                (workspace_id, new_summary, fold[-1][0], estimate_tokens(new_summary), model),
+            )
+
+def enqueue_chat_summary(workspace_id, api_key=None):
+    return submit_background(update_chat_summary, workspace_id, api_key)
+
+# -----------------------------------------------------------------------------
+# PDF INGESTION
+# -----------------------------------------------------------------------------
+
+INGEST_WORKERS = 2
+INGEST_PROGRESS_INTERVAL = 0.5
+INGEST_STALE_SECONDS = 300
+INGEST_POLL_SECONDS = 2
+INGEST_JOBS_SHOWN = 20
+PDF_EXTRACT_PROCESSES = os.cpu_count() or 2
+
+@st.cache_resource
+def get_pdf_process_pool():
+    # spawn, not fork: the server process is multi-threaded, and workers only
+    # need pdf_extract, never this script.
+    return ProcessPoolExecutor(max_workers=PDF_EXTRACT_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+
+@timed("pdf")
+def extract_pdf_text(path, progress=None):
+    import pdf_extract
+    if PDF_EXTRACT_PROCESSES < 2:
+        return pdf_extract.extract_pdf(path, None, progress=progress)
+    try:
+        return pdf_extract.extract_pdf(path, get_pdf_process_pool(), progress=progress)
+    except BrokenProcessPool:
+        # A worker died earlier and poisoned the pool; replace it and do this
+        # document in-thread.
+        get_pdf_process_pool.clear()
+        return pdf_extract.extract_pdf(path, None, progress=progress)
+
+# Uploads are persisted as jobs (payload included) and processed on a worker
+# pool that outlives reruns. On the first use in a process, jobs left queued
+# by a previous process are picked up again. A running job that has not
+# reported progress for INGEST_STALE_SECONDS was lost with its process; the
+# job list requeues those whenever it shows one (a process restarted soon
+# after a crash finds them still fresh at startup).
+INGEST_STALE_SQL = "status = 'running' AND updated_at < datetime('now', ?)"
+
+@st.cache_resource
+def get_ingest_executor():
+    executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="pdf-ingest")
+    with db_transaction() as conn:
+        conn.execute(f"UPDATE ingest_jobs SET status = 'queued' WHERE {INGEST_STALE_SQL}", (f"-{INGEST_STALE_SECONDS} seconds",))
+        pending = [r[0] for r in conn.execute("SELECT id FROM ingest_jobs WHERE status = 'queued' ORDER BY id")]
+    for job_id in pending:
+        executor.submit(run_ingest_job, job_id)
+    return executor
+
+def requeue_stale_ingest_jobs():
+    with db_transaction() as conn:
+        stale = [r[0] for r in conn.execute(f"SELECT id FROM ingest_jobs WHERE {INGEST_STALE_SQL}", (f"-{INGEST_STALE_SECONDS} seconds",))]
+        conn.executemany(
+            f"UPDATE ingest_jobs SET status = 'queued', updated_at = CURRENT_TIMESTAMP WHERE id = ? AND {INGEST_STALE_SQL}",
+            [(job_id, f"-{INGEST_STALE_SECONDS} seconds") for job_id in stale],
+        )
+    for job_id in stale:
+        get_ingest_executor().submit(run_ingest_job, job_id)
+    return stale
+
+def submit_ingest_job(user_id, workspace_id, filename, data, api_key=None):
+    with db_transaction() as conn:
+        cur = conn.execute(
+            "INSERT INTO ingest_jobs (user_id, workspace_id, filename, payload) VALUES (?, ?, ?, ?)",
+            (user_id, workspace_id, filename, data),
+        )
+    get_ingest_executor().submit(run_ingest_job, cur.lastrowid, api_key)
+    return cur.lastrowid
+
+def retry_ingest_job(job_id, api_key=None):
+    # Failed jobs, and running ones whose worker is gone.
+    with db_transaction() as conn:
+        conn.execute(
+            f'''UPDATE ingest_jobs SET status = 'queued', error = NULL, pages_done = 0, updated_at = CURRENT_TIMESTAMP
+               WHERE id = ? AND (status = 'failed' OR {INGEST_STALE_SQL})''',
+            (job_id, f"-{INGEST_STALE_SECONDS} seconds"),
+        )
+    get_ingest_executor().submit(run_ingest_job, job_id, api_key)
+
+def update_ingest_job(job_id, **fields):
+    columns = ", ".join(f"{name} = ?" for name in fields)
+    with db_transaction() as conn:
+        conn.execute(
+            f"UPDATE ingest_jobs SET {columns}, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (*fields.values(), job_id),
+        )
+
+@timed("pipeline")
+def run_ingest_job(job_id, api_key=None):
+    # Claiming is a conditional UPDATE, so a job is only ever run once even if
+    # it was submitted twice (e.g. by a retry racing the startup recovery).
+    with db_transaction() as conn:
+        claimed = conn.execute(
+            "UPDATE ingest_jobs SET status = 'running', updated_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'queued'",
+            (job_id,),
+        ).rowcount
+        row = conn.execute("SELECT workspace_id, filename, payload FROM ingest_jobs WHERE id = ?", (job_id,)).fetchone()
+    if not claimed:
+        return
+    workspace_id, filename, payload = row
+
+    last_report = 0.0
+
+    def report(done, total):
+        nonlocal last_report
+        if done in (0, total) or time.monotonic() - last_report >= INGEST_PROGRESS_INTERVAL:
+            update_ingest_job(job_id, pages_done=done, pages_total=total)
+            last_report = time.monotonic()
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(payload)
+    try:
+        text, stats = extract_pdf_text(f.name, report)
+        paper_id = import_paper(workspace_id, filename, "Uploaded", text[:500], text, "Local", api_key)
+        update_ingest_job(
+            job_id, status='done', paper_id=paper_id, payload=None,
+            page_stats=json.dumps([[page, round(seconds, 4), chars, error] for page, seconds, chars, error in stats]),
+        )
+    except Exception as e:
+        update_ingest_job(job_id, status='failed', error=str(e))
+    finally:
+        os.unlink(f.name)
+
+@timed("db")
+def get_ingest_jobs(workspace_id, limit=INGEST_JOBS_SHOWN):
+    with get_pool().connection() as conn:
+        rows = conn.execute(
+            f'''SELECT id, filename, status, pages_done, pages_total, error, page_stats, {INGEST_STALE_SQL}
+               FROM ingest_jobs WHERE workspace_id = ? ORDER BY id DESC LIMIT ?''',
+            (f"-{INGEST_STALE_SECONDS} seconds", workspace_id, limit),
+        ).fetchall()
+    return [
+        {'id': r[0], 'filename': r[1], 'status': r[2], 'pages_done': r[3], 'pages_total': r[4], 'error': r[5],
+         'page_stats': json.loads(r[6]) if r[6] else [], 'stale': bool(r[7])}
+        for r in rows
+    ]
+
+# -----------------------------------------------------------------------------
+# SEARCH ENGINE
+# -----------------------------------------------------------------------------
+
+ARXIV_API_URL = os.environ.get("ARXIV_API_URL", "https://export.arxiv.org/api/query")
+ARXIV_TIMEOUT = (5, 30)
+ARXIV_RESULTS = 25
+ARXIV_PAGE_SIZE = 50
+ARXIV_CONCURRENCY = 3
+# arXiv asks API clients for no more than one request every three seconds.
+ARXIV_MIN_INTERVAL = float(os.environ.get("ARXIV_MIN_INTERVAL", "3.0"))
+ARXIV_RETRIES = 3
+ARXIV_BACKOFF = 2.0
+ARXIV_RETRY_STATUS = (429, 500, 502, 503, 504)
+ARXIV_CACHE_DIR = 'arxiv_cache'
+ARXIV_CACHE_TTL = 24 * 3600
+
+ATOM_NS = "{http://www.w3.org/2005/Atom}"
+OPENSEARCH_NS = "{http://a9.com/-/spec/opensearch/1.1/}"
+
+class ArxivError(Exception):
+    pass
+
+# Spaces request start times at least `interval` apart across every thread
+# sharing it; slow responses still overlap.
+class RateLimiter:
+    def __init__(self, interval):
+        self.interval = interval
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self, not_before=0.0):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next, not_before)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+# Search results on disk as one JSON file per (normalized query, count),
+# expired by file age.
+class ArxivCache:
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl = ttl
+
+    def _path(self, query, max_results):
+        normalized = " ".join(query.lower().split())
+        key = hashlib.sha256(f"{normalized}\0{max_results}".encode()).hexdigest()
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, query, max_results):
+        path = self._path(query, max_results)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, query, max_results, papers):
+        path = self._path(query, max_results)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(papers, f)
+        os.replace(path + '.tmp', path)
+
+def iter_atom_entries(stream, meta=None):
+    # Streams an Atom feed (API response or dump file), dropping each entry
+    # once read. The feed's opensearch totalResults, if any, goes in meta.
+    import xml.etree.ElementTree as ET
+    root = None
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            continue
+        if elem.tag == OPENSEARCH_NS + 'totalResults' and meta is not None:
+            meta['total'] = int(elem.text or 0)
+        elif elem.tag == ATOM_NS + 'entry':
+            link = (elem.findtext(ATOM_NS + 'id') or "").strip()
+            summary = " ".join((elem.findtext(ATOM_NS + 'summary') or "").split())
+            # The API reports errors as a single entry pointing at its error page.
+            if '/api/errors' in link:
+                raise ArxivError(summary or "arXiv API error")
+            yield {
+                'arxiv_id': arxiv_id(link) or link,
+                'title': " ".join((elem.findtext(ATOM_NS + 'title') or "").split()),
+                'authors': ", ".join(a.findtext(ATOM_NS + 'name') for a in elem.findall(ATOM_NS + 'author')),
+                'abstract': summary,
+                'categories': " ".join(c.get('term', '') for c in elem.findall(ATOM_NS + 'category')),
+                'updated': elem.findtext(ATOM_NS + 'updated'),
+                'source': link,
+            }
+            # Clearing the entry alone would leave an empty element per
+            # entry hanging off the feed.
+            root.clear()
+
+def parse_arxiv_feed(stream):
+    # Returns (papers, total results reported by the API).
+    meta = {}
+    papers = [
+        {'title': e['title'], 'abstract': e['abstract'], 'authors': e['authors'], 'source': e['source'], 'content': e['abstract']}
+        for e in iter_atom_entries(stream, meta)
+    ]
+    return papers, meta.get('total')
+
+class ArxivClient:
+    def __init__(self, base_url=ARXIV_API_URL, cache_dir=ARXIV_CACHE_DIR, min_interval=ARXIV_MIN_INTERVAL):
+        self.base_url = base_url
+        self.cache = ArxivCache(cache_dir, ARXIV_CACHE_TTL) if cache_dir else None
+        self.limiter = RateLimiter(min_interval)
+        import requests
+        self.session = requests.Session()
+        self.session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=ARXIV_CONCURRENCY))
+        self.session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=ARXIV_CONCURRENCY))
+        self.session.headers['User-Agent'] = "ResearchHub/1.0"
+        self.executor = ThreadPoolExecutor(max_workers=ARXIV_CONCURRENCY, thread_name_prefix="arxiv")
+
+    @timed("arxiv")
+    def fetch_page(self, query, start, size):
+        import requests
+        params = {'search_query': f"all:{query}", 'start': start, 'max_results': size}
+        retry_at = 0.0
+        for attempt in range(ARXIV_RETRIES + 1):
+            self.limiter.wait(retry_at)
+            try:
+                with self.session.get(self.base_url, params=params, timeout=ARXIV_TIMEOUT, stream=True) as response:
+                    if response.status_code in ARXIV_RETRY_STATUS and attempt < ARXIV_RETRIES:
+                        delay = response.headers.get('Retry-After', '')
+                        delay = float(delay) if delay.isdigit() else ARXIV_BACKOFF * 2 ** attempt
+                        retry_at = time.monotonic() + delay
+                        continue
+                    response.raise_for_status()
+                    response.raw.decode_content = True
+                    return parse_arxiv_feed(response.raw)
+            except ArxivError:
+                raise
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == ARXIV_RETRIES:
+                    raise ArxivError(f"arXiv unreachable: {e}") from e
+                retry_at = time.monotonic() + ARXIV_BACKOFF * 2 ** attempt
+            except requests.HTTPError as e:
+                raise ArxivError(f"arXiv returned HTTP {e.response.status_code}") from e
+            except SyntaxError as e:
+                # xml.etree.ElementTree.ParseError: a truncated or garbled feed.
+                if attempt == ARXIV_RETRIES:
+                    raise ArxivError(f"Unreadable arXiv response: {e}") from e
+                retry_at = time.monotonic() + ARXIV_BACKOFF * 2 ** attempt
+        raise ArxivError("arXiv is rate limiting requests; try again shortly")
+
+    def search(self, query, max_results=ARXIV_RESULTS):
+        query = " ".join(query.split())
+        if not query:
+            return []
+        if self.cache:
+            cached = self.cache.get(query, max_results)
+            if cached is not None:
+                return cached
+
+        # The first page tells us how many results exist; the rest are fetched
+        # concurrently (still paced by the rate limiter) and kept in order.
+        papers, total = self.fetch_page(query, 0, min(ARXIV_PAGE_SIZE, max_results))
+        wanted = min(max_results, total if total is not None else len(papers))
+        starts = range(ARXIV_PAGE_SIZE, wanted, ARXIV_PAGE_SIZE)
+        pages = self.executor.map(lambda start: self.fetch_page(query, start, min(ARXIV_PAGE_SIZE, wanted - start))[0], starts)
+        for page in pages:
+            papers.extend(page)
+        papers = papers[:max_results]
+
+        if self.cache:
+            self.cache.put(query, max_results, papers)
         return papers
-    except:
+
+@st.cache_resource
+def get_arxiv_client():
+    return ArxivClient()
+
+# ---- Local mirror ----
+
+# "auto" searches the local mirror first and goes to the API only when it has
+# no hits; "local" and "remote" use one side only.
+ARXIV_SEARCH_BACKEND = os.environ.get("ARXIV_SEARCH_BACKEND", "auto")
+ARXIV_MIRROR_BATCH = 5000
+ARXIV_MIRROR_UPSERT = '''
+    INSERT INTO arxiv_mirror (arxiv_id, title, authors, abstract, categories, updated)
+    VALUES (:arxiv_id, :title, :authors, :abstract, :categories, :updated)
+    ON CONFLICT (arxiv_id) DO UPDATE SET
+        title = excluded.title, authors = excluded.authors, abstract = excluded.abstract,
+        categories = excluded.categories, updated = excluded.updated
+    WHERE excluded.updated IS NOT arxiv_mirror.updated
+'''
+
+def iter_arxiv_jsonl(stream):
+    # The Kaggle / OAI snapshot format: one JSON object per line.
+    for line in stream:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        yield {
+            'arxiv_id': record['id'],
+            'title': " ".join((record.get('title') or "").split()),
+            'authors': " ".join((record.get('authors') or "").split()),
+            'abstract': " ".join((record.get('abstract') or "").split()),
+            'categories': record.get('categories'),
+            'updated': record.get('update_date'),
+        }
+
+def iter_arxiv_dump(path):
+    # .jsonl/.json files are JSON lines, anything else is read as Atom XML;
+    # a trailing .gz is decompressed on the fly.
+    import gzip
+    opener = gzip.open if path.endswith('.gz') else open
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith(('.jsonl', '.json')):
+        with opener(path, 'rt', encoding='utf-8') as f:
+            yield from iter_arxiv_jsonl(f)
+    else:
+        with opener(path, 'rb') as f:
+            yield from iter_atom_entries(f)
+
+def load_arxiv_mirror(paths, batch_size=ARXIV_MIRROR_BATCH, progress=None):
+    # Streams every record through fixed-size executemany batches, one
+    # transaction each, so memory stays flat however large the dump is.
+    # Re-loading a dump only rewrites records whose update date changed.
+    loaded = 0
+    for path in paths:
+        records = iter_arxiv_dump(path)
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+            with db_transaction() as conn:
+                conn.executemany(ARXIV_MIRROR_UPSERT, batch)
+            loaded += len(batch)
+            if progress:
+                progress(path, loaded)
+    return loaded
+
+@timed("arxiv")
+def search_arxiv_mirror(query, max_results=ARXIV_RESULTS):
+    match = fts_query(query)
+    if match is None:
         return []
+    with get_pool().connection() as conn:
+        rows = conn.execute(
+            '''SELECT m.arxiv_id, m.title, m.authors, m.abstract
+               FROM arxiv_mirror_fts JOIN arxiv_mirror m ON m.id = arxiv_mirror_fts.rowid
+               WHERE arxiv_mirror_fts MATCH ?
+               ORDER BY bm25(arxiv_mirror_fts, 10.0, 4.0, 1.0)
+               LIMIT ?''',
+            (match, max_results),
+        ).fetchall()
+    return [
+        {'title': title, 'abstract': abstract, 'authors': authors, 'source': f"http://arxiv.org/abs/{aid}", 'content': abstract}
+        for aid, title, authors, abstract in rows
+    ]
+
+@timed("arxiv")
+def search_arxiv(query, max_results=ARXIV_RESULTS):
+    if ARXIV_SEARCH_BACKEND != "remote":
+        papers = search_arxiv_mirror(query, max_results)
+        if papers or ARXIV_SEARCH_BACKEND == "local":
+            return papers
+    return get_arxiv_client().search(query, max_results)
+
+# Column weights for bm25(): a title hit outranks one buried in the body.
+LIBRARY_RANK_WEIGHTS = (10.0, 4.0, 2.0, 1.0)
+SNIPPET_OPEN, SNIPPET_CLOSE = "\x02", "\x03"
+
+def fts_query(text):
+    # Quote every term so user input can never be parsed as FTS5 syntax; the
+    # last term is a prefix match so results follow the user as they type.
+    terms = re.findall(r"\w+", text)
+    if not terms:
+        return None
+    quoted = ['"' + t.replace('"', '""') + '"' for t in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+@timed("db")
+def search_library(user_id, query, workspace_id=None, limit=20):
+    match = fts_query(query)
+    if match is None:
+        return []
+    sql = f'''
+        SELECT p.id, p.workspace_id, w.name, p.title, p.authors, p.source,
+               snippet(papers_fts, -1, ?, ?, '…', 24),
+               bm25(papers_fts, {", ".join(map(str, LIBRARY_RANK_WEIGHTS))}) AS score
+        FROM papers_fts
+        JOIN papers p ON p.id = papers_fts.rowid
+        JOIN workspaces w ON w.id = p.workspace_id
+        WHERE papers_fts MATCH ? AND w.user_id = ?
+    '''
+    params = [SNIPPET_OPEN, SNIPPET_CLOSE, match, user_id]
+    if workspace_id is not None:
+        sql += " AND p.workspace_id = ?"
+        params.append(workspace_id)
+    sql += " ORDER BY score LIMIT ?"
+    params.append(limit)
+    with get_pool().connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return [
+        {'paper_id': r[0], 'workspace_id': r[1], 'workspace_name': r[2], 'title': r[3],
+         'authors': r[4], 'source': r[5], 'snippet': r[6], 'score': r[7]}
+        for r in rows
+    ]
+
+def highlight_snippet(snippet):
+    return (html.escape(snippet or "")
+            .replace(SNIPPET_OPEN, '<mark style="background:#6c5ce7; color:#fff;">')
+            .replace(SNIPPET_CLOSE, "</mark>"))
 
 # -----------------------------------------------------------------------------
 # UI COMPONENTS
 # -----------------------------------------------------------------------------
 
+# Comma-separated usernames allowed to see the Performance page; when unset,
+# nobody is (its Reset clears metrics for every user of the process).
+ADMIN_USERS = frozenset(u.strip() for u in os.environ.get("RESEARCHHUB_ADMINS", "").split(",") if u.strip())
+
+def is_admin(username):
+    return username in ADMIN_USERS
+
 def sidebar_nav():
     with st.sidebar:
         st.markdown("""
@@ -413,6 +2944,8 @@ def sidebar_nav():
                 "Doc Space": "📝",
                 "AI Chatbot": "💬"
             }
+            if is_admin(st.session_state.get('username')):
+                nav_options["Performance"] = "⏱️"
             
             selected = st.radio(
                 "Navigate",
@@ -436,6 +2969,12 @@ def sidebar_nav():
     value=st.session_state['groq_key'],
     type="password"
 )
+                st.session_state['llm_cache_bypass'] = st.checkbox(
+                    "Bypass AI response cache",
+                    value=st.session_state.get('llm_cache_bypass', False)
+                )
+                stats = get_llm_cache_stats()
+                st.caption(f"AI cache: {stats.hits} hits / {stats.misses} misses")
 
             
             return selected
@@ -464,23 +3003,32 @@ def page_login():
                 u = st.text_input("Username")
                 p = st.text_input("Password", type="password")
                 if st.form_submit_button("Sign In", use_container_width=True):
-                    uid = authenticate_user(u, p)
-                    if uid:
-                        st.session_state['user_id'] = uid
-                        st.session_state['username'] = u
-                        st.rerun()
+                    try:
+                        uid = authenticate_user(u, p)
+                    except LoginThrottled as e:
+                        st.warning(str(e))
                     else:
-                        st.error("Invalid credentials")
+                        if uid:
+                            st.session_state['user_id'] = uid
+                            st.session_state['username'] = u
+                            st.rerun()
+                        else:
+                            st.error("Invalid credentials")
         
         with tab2:
             with st.form("register"):
                 nu = st.text_input("New Username")
                 np = st.text_input("New Password", type="password")
                 if st.form_submit_button("Create Account", use_container_width=True):
-                    if register_user(nu, np):
-                        st.success("Account created! Please login.")
+                    try:
+                        created = register_user(nu, np)
+                    except LoginThrottled as e:
+                        st.warning(str(e))
                     else:
-                        st.error("Username taken")
+                        if created:
+                            st.success("Account created! Please login.")
+                        else:
+                            st.error("Username taken")
 
 def page_home():
     st.markdown("""
@@ -513,18 +3061,16 @@ def page_home():
 def page_dashboard():
     st.title("Dashboard")
     uid = st.session_state['user_id']
-    workspaces = get_workspaces(uid)
+    workspaces = get_workspaces(uid, columns=('id', 'name', 'description', 'created_at'))
+    ws_stats = get_workspace_stats(uid)
     
     # Stats
     col1, col2, col3 = st.columns(3)
     
-    total_papers = 0
-    if not workspaces.empty:
-        for wid in workspaces['id']:
-            total_papers += len(get_papers(wid))
+    total_papers = sum(w.paper_count for w in ws_stats)
             
     stats = [
-        ("Total Workspaces", len(workspaces), "📂"),
+        ("Total Workspaces", len(ws_stats), "📂"),
         ("Papers Imported", total_papers, "📄"),
         ("Active Session", "Online", "🟢")
     ]
@@ -551,21 +3097,21 @@ def page_dashboard():
                 create_workspace(uid, name, desc)
                 st.rerun()
 
-    if not workspaces.empty:
+    if workspaces:
         cols = st.columns(3)
-        for i, (idx, row) in enumerate(workspaces.iterrows()):
+        for i, row in enumerate(workspaces):
             with cols[i % 3]:
                 st.markdown(f"""
                 <div class="card">
-                    <h4>{row['name']}</h4>
-                    <p style="font-size: 0.9rem; color: #b0b3c5;">{row['description']}</p>
-                    <p style="font-size: 0.8rem; color: #6c5ce7;">{row['created_at'][:10]}</p>
+                    <h4>{row.name}</h4>
+                    <p style="font-size: 0.9rem; color: #b0b3c5;">{row.description}</p>
+                    <p style="font-size: 0.8rem; color: #6c5ce7;">{row.created_at[:10]}</p>
                 </div>
                 """, unsafe_allow_html=True)
-                if st.button(f"Open {row['name']}", key=f"open_{row['id']}", use_container_width=True):
-                    st.session_state['current_workspace_id'] = row['id']
-                    st.session_state['current_workspace_name'] = row['name']
-                    st.success(f"Active: {row['name']}")
+                if st.button(f"Open {row.name}", key=f"open_{row.id}", use_container_width=True):
+                    st.session_state['current_workspace_id'] = row.id
+                    st.session_state['current_workspace_name'] = row.name
+                    st.success(f"Active: {row.name}")
 
 def page_search():
     st.title("Search Papers")
@@ -574,15 +3120,25 @@ def page_search():
         st.warning("⚠️ Please select a workspace from Dashboard or Workspaces tab first.")
         return
         
-    c1, c2 = st.columns([4,1])
+    mode = st.radio("Source", ["arXiv", "My library"], horizontal=True, label_visibility="collapsed")
+    if mode == "My library":
+        page_search_library()
+        return
+
+    c1, c2, c3 = st.columns([4,1,1])
     with c1:
         query = st.text_input("Keywords", placeholder="e.g. Generative Adversarial Networks", label_visibility="collapsed")
     with c2:
+        max_results = st.selectbox("Results", [10, 25, 50, 100, 200], index=1, label_visibility="collapsed")
+    with c3:
         search_btn = st.button("Search arXiv", use_container_width=True)
         
     if search_btn and query:
         with st.spinner("Searching..."):
-            st.session_state['search_results'] = search_arxiv(query)
+            try:
+                st.session_state['search_results'] = search_arxiv(query, max_results)
+            except ArxivError as e:
+                st.error(f"arXiv search failed: {e}")
             
     if 'search_results' in st.session_state:
         st.markdown(f"Found {len(st.session_state['search_results'])} results")
@@ -599,9 +3155,31 @@ def page_search():
                 </div>
                 """, unsafe_allow_html=True)
                 if st.button(f"📥 Import to {st.session_state['current_workspace_name']}", key=f"add_{i}"):
-                    add_paper(st.session_state['current_workspace_id'], p['title'], p['authors'], p['abstract'], p['content'], p['source'])
+                    import_paper(st.session_state['current_workspace_id'], p['title'], p['authors'], p['abstract'], p['content'], p['source'], st.session_state.get('groq_key'))
                     st.success("Imported!")
 
+def page_search_library():
+    c1, c2 = st.columns([4,1])
+    with c1:
+        query = st.text_input("Search my library", placeholder="e.g. contrastive pretraining", label_visibility="collapsed")
+    with c2:
+        scope = st.selectbox("Scope", ["This workspace", "All workspaces"], label_visibility="collapsed")
+
+    if not query:
+        return
+
+    workspace_id = st.session_state['current_workspace_id'] if scope == "This workspace" else None
+    results = search_library(st.session_state['user_id'], query, workspace_id)
+    st.markdown(f"Found {len(results)} results")
+    for r in results:
+        st.markdown(f"""
+        <div class="card">
+            <h4 style="color:#a29bfe;">{html.escape(r['title'])}</h4>
+            <p style="color: #ffffff; font-style:italic; font-size: 0.9rem;">{html.escape(r['authors'] or '')} · {html.escape(r['workspace_name'])}</p>
+            <p style="color: #b0b3c5; font-size: 0.95rem;">{highlight_snippet(r['snippet'])}</p>
+        </div>
+        """, unsafe_allow_html=True)
+
 def page_ai_tools():
     st.title("AI Tools")
     
@@ -609,14 +3187,39 @@ def page_ai_tools():
         st.warning("⚠️ Select a workspace first.")
         return
 
-    papers = get_papers(st.session_state['current_workspace_id'])
-    if papers.empty:
+    papers = get_papers(st.session_state['current_workspace_id'], columns=('id', 'workspace_id', 'title'))
+    if not papers:
         st.info("No papers in this workspace.")
         return
 
     # Selection
     st.markdown("### 1. Select Papers")
-    selected_titles = st.multiselect("Choose papers for analysis", papers['title'].tolist())
+    selected_titles = st.multiselect("Choose papers for analysis", [p.title for p in papers])
+
+    if selected_titles:
+        selected_ids = [p.id for p in papers if p.title in selected_titles]
+        with st.expander("🔗 Related papers in this workspace"):
+            titles = {p.id: p.title for p in papers}
+            for pid, related in related_papers(st.session_state['current_workspace_id'], selected_ids).items():
+                st.markdown(f"**{titles[pid]}**")
+                for r in related:
+                    st.markdown(f"- {r['title']} ({r['score']:.2f})")
+        # Removal asks for confirmation of exactly the papers it names.
+        if st.session_state.get('confirm_remove') != selected_ids:
+            if st.button(f"🗑️ Remove {len(selected_ids)} selected from workspace"):
+                st.session_state['confirm_remove'] = selected_ids
+                st.rerun()
+        else:
+            st.warning(f"Remove {', '.join(selected_titles)} from this workspace? This cannot be undone.")
+            c1, c2 = st.columns(2)
+            if c1.button("Remove", type="primary", use_container_width=True):
+                for pid in selected_ids:
+                    delete_paper(st.session_state['current_workspace_id'], pid)
+                del st.session_state['confirm_remove']
+                st.rerun()
+            if c2.button("Cancel", use_container_width=True):
+                del st.session_state['confirm_remove']
+                st.rerun()
     
     st.markdown("### 2. Choose Action")
     col1, col2, col3 = st.columns(3)
@@ -644,16 +3247,26 @@ def page_ai_tools():
         else:
             st.markdown("---")
             st.markdown(f"### Results: {action}")
-            with st.spinner("Processing..."):
-                subset = papers[papers['title'].isin(selected_titles)].to_dict('records')
-                prompt = f"Perform task: {action} on these papers."
-                res = generate_ai_response(prompt, subset, st.session_state.get('groq_key'))
-                
-                st.markdown(f'''
-                <div class="card">
-                    {res}
-                </div>
-                ''', unsafe_allow_html=True)
+            subset = [p for p in papers if p.title in selected_titles]
+            with st.spinner("Preparing paper summaries..."):
+                summaries = ensure_paper_summaries([p.id for p in subset], st.session_state.get('groq_key'))
+
+            # Summaries and insights are precomputed per paper; only the
+            # literature review needs a (bounded) reduce call to the model.
+            with st.container(border=True):
+                if action == "Summarize":
+                    for p in subset:
+                        st.markdown(f"**{p.title}**\n\n{summaries[p.id]['summary']}")
+                elif action == "Extract Key Insights":
+                    for p in subset:
+                        insights = "\n".join(f"- {i}" for i in summaries[p.id]['insights'])
+                        st.markdown(f"**{p.title}**\n\n{insights}")
+                else:
+                    prompt = f"Perform task: {action} on these papers."
+                    context_text = build_summary_context(subset, summaries)
+                    usage = {}
+                    st.write_stream(generate_ai_response_stream(prompt, subset, st.session_state.get('groq_key'), not st.session_state.get('llm_cache_bypass'), context_text, usage=usage))
+                    st.caption(format_usage(usage))
 
 def page_upload():
     st.title("Upload PDF")
@@ -669,27 +3282,51 @@ def page_upload():
     </div>
     """, unsafe_allow_html=True)
     
-    f = st.file_uploader("", type="pdf", label_visibility="collapsed")
+    files = st.file_uploader("", type="pdf", accept_multiple_files=True, label_visibility="collapsed")
     
-    if f:
+    if files:
         col1, col2 = st.columns(2)
         with col1:
             if st.button("Save to Workspace", use_container_width=True):
-                try:
-                    reader = PyPDF2.PdfReader(f)
-                    text = "".join([p.extract_text() for p in reader.pages])
-                    add_paper(st.session_state['current_workspace_id'], f.name, "Uploaded", text[:500], text, "Local")
-                    st.success("Saved!")
-                except Exception as e:
-                    st.error(f"Error: {e}")
+                for f in files:
+                    submit_ingest_job(st.session_state['user_id'], st.session_state['current_workspace_id'], f.name, f.getvalue(), st.session_state.get('groq_key'))
+                st.success(f"Queued {len(files)} file(s) for processing.")
         with col2:
              if st.button("Generate Summary", use_container_width=True):
                  st.info("Using AI to summarize uploaded doc...")
 
+    render_ingest_jobs(st.session_state['current_workspace_id'])
+
+@st.fragment(run_every=INGEST_POLL_SECONDS)
+def render_ingest_jobs(workspace_id):
+    jobs = get_ingest_jobs(workspace_id)
+    if not jobs:
+        return
+    if any(job['stale'] for job in jobs):
+        requeue_stale_ingest_jobs()
+    st.markdown("### Processing")
+    for job in jobs:
+        if job['status'] == 'failed' or job['stale']:
+            c1, c2 = st.columns([4, 1])
+            if job['stale']:
+                c1.warning(f"{job['filename']}: stopped responding at page {job['pages_done']}/{job['pages_total'] or '?'}")
+            else:
+                c1.error(f"{job['filename']}: {job['error']}")
+            if c2.button("Retry", key=f"retry_job_{job['id']}", use_container_width=True):
+                retry_ingest_job(job['id'], st.session_state.get('groq_key'))
+            continue
+        total = job['pages_total']
+        progress = 1.0 if job['status'] == 'done' else (job['pages_done'] / total if total else 0.0)
+        label = "done" if job['status'] == 'done' else f"{job['status']} · page {job['pages_done']}/{total or '?'}"
+        st.progress(progress, text=f"{job['filename']} — {label}")
+        bad_pages = [s[0] + 1 for s in job['page_stats'] if s[3]]
+        if bad_pages:
+            st.caption(f"Text could not be extracted from page(s) {', '.join(map(str, bad_pages))}.")
+
 def page_doc_space():
     st.title("Doc Space")
     uid = st.session_state['user_id']
-    docs = get_docs(uid)
+    docs = get_docs(uid, columns=('id', 'title'))
     
     c1, c2 = st.columns([1, 3])
     
@@ -699,9 +3336,11 @@ def page_doc_space():
             st.session_state['active_doc'] = {'id': None, 'title': 'Untitled', 'content': ''}
             st.rerun()
             
-        for i, row in docs.iterrows():
-            if st.button(f"📄 {row['title']}", key=f"doc_list_{row['id']}", use_container_width=True):
-                st.session_state['active_doc'] = row.to_dict()
+        for row in docs:
+            if st.button(f"📄 {row.title}", key=f"doc_list_{row.id}", use_container_width=True):
+                doc = get_doc(uid, row.id)
+                if doc is not None:
+                    st.session_state['active_doc'] = doc._asdict()
                 st.rerun()
                 
     with c2:
@@ -734,41 +3373,106 @@ def page_chatbot():
     ws_id = st.session_state['current_workspace_id']
     st.caption(f"Context: {st.session_state['current_workspace_name']}")
     
-    msgs = get_chat_history(ws_id)
+    # Only the latest page is rendered until the user asks for more; the
+    # window then stays anchored at the oldest message they loaded.
+    window = st.session_state.get('chat_window')
+    since_id = window[1] if window and window[0] == ws_id else None
+    msgs, has_older = get_chat_history(ws_id, since_id=since_id)
+    if has_older and st.button("Load older messages"):
+        older, _ = get_chat_history(ws_id, before_id=msgs[0].id)
+        st.session_state['chat_window'] = (ws_id, older[0].id)
+        st.rerun()
     for m in msgs:
-        with st.chat_message(m['role']):
-            st.write(m['content'])
+        with st.chat_message(m.role):
+            st.write(m.content)
             
     if p := st.chat_input():
+        memory = get_chat_memory(ws_id)
         save_chat(ws_id, "user", p)
         with st.chat_message("user"):
             st.write(p)
             
         with st.chat_message("assistant"):
-            papers = get_papers(ws_id).to_dict('records')
-            response = generate_ai_response(p, papers, st.session_state.get('groq_key'))
-            st.write(response)
+            papers = get_papers(ws_id, columns=('id', 'workspace_id', 'title'))
+            usage = {}
+            response = st.write_stream(generate_ai_response_stream(p, papers, st.session_state.get('groq_key'), not st.session_state.get('llm_cache_bypass'), chat_memory=memory, usage=usage))
             save_chat(ws_id, "assistant", response)
+            st.caption(format_usage(usage))
+        enqueue_chat_summary(ws_id, st.session_state.get('groq_key'))
+
+def page_performance():
+    import pandas as pd
+    st.title("Performance")
+    st.caption(f"Latency of the last {METRICS_RING_SIZE:,} calls per operation in this server process.")
+    st.caption(f"Read cache: {READ_CACHE.hits} hits / {READ_CACHE.misses} misses, {len(READ_CACHE)} of {READ_CACHE.max_entries} entries")
+
+    rows = METRICS.snapshot()
+    if not rows:
+        st.info("Nothing recorded yet.")
+    else:
+        df = pd.DataFrame(rows)
+        df.insert(0, 'category', df['name'].str.split('.').str[0])
+        categories = ["All"] + sorted(df['category'].unique())
+        category = st.selectbox("Category", categories)
+        if category != "All":
+            df = df[df['category'] == category]
+        df = df.sort_values('p95_ms', ascending=False)
+        st.bar_chart(df.set_index('name')['p95_ms'], horizontal=True)
+        st.dataframe(df.drop(columns='category'), hide_index=True, use_container_width=True,
+                     column_config={c: st.column_config.NumberColumn(format="%.1f") for c in df.columns if c.endswith('_ms')})
+        if st.button("Reset"):
+            METRICS.reset()
+            st.rerun()
+
+    if METRICS_FLUSH_INTERVAL:
+        st.markdown("### Persisted (last 24h)")
+        since = time.time() - 24 * 3600
+        with get_pool().connection() as conn:
+            history = conn.execute(
+                "SELECT name, seconds FROM metrics_samples WHERE recorded_at >= ? ORDER BY name", (since,)
+            ).fetchall()
+        by_name = {}
+        for name, seconds in history:
+            by_name.setdefault(name, []).append(seconds)
+        if by_name:
+            persisted = pd.DataFrame([summarize_samples(n, np.array(v)) for n, v in by_name.items()])
+            st.dataframe(persisted.sort_values('p95_ms', ascending=False), hide_index=True, use_container_width=True)
+        else:
+            st.caption("No samples flushed yet.")
 
 # -----------------------------------------------------------------------------
 # MAIN APP
 # -----------------------------------------------------------------------------
 
 def main():
+    init_db()
+
     if 'user_id' not in st.session_state:
         page_login()
     else:
         choice = sidebar_nav()
         
-        if choice == "Home": page_home()
-        elif choice == "Dashboard": page_dashboard()
-        elif choice == "Search Papers": page_search()
-        elif choice == "Workspaces": page_workspaces_list()
-        elif choice == "AI Tools": page_ai_tools()
-        elif choice == "Upload PDF": page_upload()
-        elif choice == "Doc Space": page_doc_space()
-        elif choice == "AI Chatbot": page_chatbot()
-        else: page_dashboard()
+        with timer(f"page.{choice}"):
+            if choice == "Home": page_home()
+            elif choice == "Dashboard": page_dashboard()
+            elif choice == "Search Papers": page_search()
+            elif choice == "Workspaces": page_workspaces_list()
+            elif choice == "AI Tools": page_ai_tools()
+            elif choice == "Upload PDF": page_upload()
+            elif choice == "Doc Space": page_doc_space()
+            elif choice == "AI Chatbot": page_chatbot()
+            elif choice == "Performance" and is_admin(st.session_state.get('username')): page_performance()
+            else: page_dashboard()
+
+@st.cache_resource
+def get_script_runs():
+    return itertools.count()
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        # The first run in a process pays for imports and one-time setup
+        # (init_db, pools, indexes); reruns should not.
+        cold = next(get_script_runs()) == 0
+        METRICS.record("script.cold" if cold else "script.rerun", time.perf_counter() - SCRIPT_STARTED)
@@ -0,0 +1,303 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import streamlit.logger
+
+# Offline benchmarks for the data layer, PDF ingestion and prompt assembly.
+# Each run seeds a fresh database in a scratch directory and prints JSON, so
+# results from two commits can be put side by side with `compare`.
+#
+#   python benchmark.py run --scale 100000 --output after.json
+#   python benchmark.py startup --output after-startup.json
+#   python benchmark.py compare before.json after.json
+
+streamlit.logger.set_log_level("error")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WORDS = (
+    "model data learning network graph attention transformer training loss gradient "
+    "optimization sample feature embedding retrieval language vision quantum protein "
+    "sequence inference benchmark dataset evaluation robust sparse dense latent prior "
+    "posterior kernel convex spectral diffusion causal reinforcement policy reward"
+).split()
+PROMPT = "Summarize the main findings on attention and retrieval in these papers."
+PAGES = ("Home", "Dashboard", "Search Papers", "Workspaces", "AI Tools", "Upload PDF", "Doc Space", "AI Chatbot", "Performance")
+HEAVY_MODULES = ("pandas", "requests", "PyPDF2", "groq")
+
+
+def text(rng, words):
+    return " ".join(rng.choices(WORDS, k=words))
+
+
+def make_pdf(pages):
+    # Minimal uncompressed PDF: one Helvetica text line per page.
+    objs = [b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    for body in pages:
+        stream = b"BT /F1 11 Tf 72 720 Td (" + body.encode('latin-1').replace(b'(', b'\\(').replace(b')', b'\\)') + b") Tj ET"
+        objs.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    pages_obj = len(objs) + len(pages) + 1
+    page_ids = []
+    for i in range(len(pages)):
+        objs.append(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] /Contents %d 0 R /Resources << /Font << /F1 1 0 R >> >> >>" % (pages_obj, i + 2))
+        page_ids.append(len(objs))
+    objs.append(b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % p for p in page_ids) + b"] /Count %d >>" % len(page_ids))
+    objs.append(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_obj)
+
+    out, offsets = bytearray(b"%PDF-1.4\n"), []
+    for i, body in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, len(objs), xref)
+    return bytes(out)
+
+
+def measure(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    times.sort()
+    return {
+        'repeat': repeat,
+        'min_ms': times[0] * 1000,
+        'median_ms': statistics.median(times) * 1000,
+        'p95_ms': times[min(len(times) - 1, int(len(times) * 0.95))] * 1000,
+        'mean_ms': statistics.fmean(times) * 1000,
+    }
+
+
+def seed(app, args, rng):
+    # The first user's first workspace is the one measured: it gets
+    # --workspace-papers real papers (chunked and embedded through add_paper)
+    # and --workspace-chats messages. Everything else is filler written in
+    # bulk so the tables have --scale rows of papers and chats overall.
+    users = max(1, args.scale // 1000)
+    password = app.hash_password("pw")  # one KDF run, not one per user
+    with app.db_transaction() as conn:
+        conn.executemany("INSERT INTO users (username, password) VALUES (?, ?)",
+                         ((f"user{u}", password) for u in range(users)))
+        conn.executemany("INSERT INTO workspaces (user_id, name, description) VALUES (?, ?, ?)",
+                         ((u + 1, f"Workspace {w}", "") for u in range(users) for w in range(args.workspaces)))
+        workspaces = [r[0] for r in conn.execute("SELECT id FROM workspaces ORDER BY id")]
+    hot = workspaces[0]
+
+    for i in range(args.workspace_papers):
+        app.add_paper(hot, f"Paper {i}: {text(rng, 6)}", "A. Author, B. Author", text(rng, 120), text(rng, args.paper_words), "Local")
+
+    filler = max(0, args.scale - args.workspace_papers)
+    for start in range(0, filler, args.batch):
+        with app.db_transaction() as conn:
+            next_body = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM paper_bodies").fetchone()[0]
+            bodies, papers = [], []
+            for n in range(start, min(start + args.batch, filler)):
+                content = f"Filler paper {n}. " + text(rng, 60)
+                body_id = next_body + len(bodies)
+                bodies.append((body_id, app.content_hash(content), app.compress_text(content), len(content)))
+                papers.append((rng.choice(workspaces[1:] or workspaces), f"Filler {n}", "X. Author", text(rng, 30), body_id, "Local"))
+            conn.executemany("INSERT INTO paper_bodies (id, sha256, content_z, content_chars) VALUES (?, ?, ?, ?)", bodies)
+            conn.executemany("INSERT INTO papers (workspace_id, title, authors, abstract, body_id, source) VALUES (?, ?, ?, ?, ?, ?)", papers)
+
+    chats = [(hot, "user" if i % 2 == 0 else "assistant", text(rng, 40)) for i in range(args.workspace_chats)]
+    chats += [(rng.choice(workspaces), "user", text(rng, 20)) for _ in range(max(0, args.scale - args.workspace_chats))]
+    for start in range(0, len(chats), args.batch):
+        with app.db_transaction() as conn:
+            conn.executemany("INSERT INTO chats (workspace_id, role, content) VALUES (?, ?, ?)", chats[start:start + args.batch])
+    return hot
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def enter_workdir(args):
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="researchhub-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    sys.path.insert(0, HERE)
+    os.chdir(workdir)  # DB_FILE, vectors/ and caches are relative paths
+    return workdir
+
+
+def report(args, workdir, results):
+    output = json.dumps({
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'cpus': os.cpu_count(),
+            'params': {k: v for k, v in vars(args).items() if k not in ('func', 'output', 'workdir', 'keep')},
+        },
+        'results': results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+    if not args.keep and not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run(args):
+    workdir = enter_workdir(args)
+    import app
+    import pdf_extract
+
+    # The mock backend sleeps to imitate a model; only prompt building is timed.
+    app.MOCK_LATENCY = app.MOCK_FIRST_TOKEN_DELAY = 0.0
+    rng = random.Random(args.seed)
+    app.init_db()
+
+    started = time.perf_counter()
+    hot = seed(app, args, rng)
+    results = {'seed': {'seconds': time.perf_counter() - started}}
+
+    # The plain names time the queries themselves (bypassing the read cache);
+    # *_cached is what a rerun with no intervening write pays.
+    results['get_papers'] = measure(lambda: app.get_papers.__wrapped__(hot), args.repeat)
+    results['get_papers_cached'] = measure(lambda: app.get_papers(hot), args.repeat)
+    results['get_chat_history'] = measure(lambda: app.get_chat_history.__wrapped__(hot), args.repeat)
+    results['get_chat_memory'] = measure(lambda: app.get_chat_memory(hot), args.repeat)
+    results['get_workspace_stats'] = measure(lambda: app.get_workspace_stats.__wrapped__(1), args.repeat)
+    results['get_workspace_stats_cached'] = measure(lambda: app.get_workspace_stats(1), args.repeat)
+    results['authenticate_user'] = measure(lambda: app.authenticate_user("user0", "pw"), min(args.repeat, 5))
+
+    bodies = [text(rng, args.paper_words) for _ in range(args.add_papers)]
+    started = time.perf_counter()
+    results['add_paper'] = measure(lambda: app.add_paper(hot, "Added", "A", text(rng, 120), bodies.pop(), "Local"), args.add_papers)
+    results['add_paper']['papers_per_s'] = args.add_papers / (time.perf_counter() - started)
+
+    papers = app.get_papers(hot, columns=('id', 'workspace_id', 'title'))
+    results['assemble_prompt'] = measure(lambda: app.assemble_prompt(PROMPT, papers, app.MOCK_MODEL), args.repeat)
+    results['generate_ai_response_mock'] = measure(lambda: app.generate_ai_response(PROMPT, papers, None, use_cache=False), args.repeat)
+
+    pdf_path = os.path.join(workdir, "bench.pdf")
+    with open(pdf_path, "wb") as f:
+        f.write(make_pdf([text(rng, args.page_words) for _ in range(args.pdf_pages)]))
+    results['pdf_extract_serial'] = measure(lambda: pdf_extract.extract_pdf(pdf_path), args.pdf_repeat)
+    results['pdf_extract'] = measure(lambda: app.extract_pdf_text(pdf_path), args.pdf_repeat)
+    for key in ('pdf_extract_serial', 'pdf_extract'):
+        results[key]['pages_per_s'] = args.pdf_pages / (results[key]['median_ms'] / 1000)
+
+    report(args, workdir, results)
+
+
+def startup(args):
+    # Runs the real script through Streamlit's AppTest in this process, which
+    # has only imported Streamlit so far, like a freshly started server. The
+    # first run is the cold start; later runs are the reruns every widget
+    # interaction triggers. Each page is timed on its first visit (when its
+    # lazy imports load) and on warm reruns. AppTest's own polling adds to
+    # those wall times, so the app.* entries, read back from the Performance
+    # page, give the script's time as measured inside it.
+    workdir = enter_workdir(args)
+    from streamlit.testing.v1 import AppTest
+
+    os.environ["RESEARCHHUB_ADMINS"] = "bench"  # shows the Performance page
+    preloaded = {m for m in HEAVY_MODULES if m in sys.modules}
+    loaded = lambda: sorted(m for m in HEAVY_MODULES if m in sys.modules and m not in preloaded)
+
+    at = AppTest.from_file(os.path.join(HERE, "app.py"), default_timeout=120)
+
+    def rerun():
+        at.run()
+        if at.exception:
+            raise SystemExit(f"app raised: {at.exception}")
+
+    results = {'cold_start': measure(rerun, 1), 'rerun.Login': measure(rerun, args.repeat)}
+    results['modules'] = {'Login': loaded()}
+
+    register, login = at.tabs[1], at.tabs[0]
+    register.text_input[0].input("bench"); register.text_input[1].input("bench")
+    register.button[0].click().run()
+    login.text_input[0].input("bench"); login.text_input[1].input("bench")
+    login.button[0].click().run()
+    if 'user_id' not in at.session_state:
+        raise SystemExit("could not log in")
+
+    for page in PAGES:
+        at.sidebar.radio[0].set_value(page)
+        results[f'first.{page}'] = measure(rerun, 1)
+        results[f'rerun.{page}'] = measure(rerun, args.repeat)
+        results['modules'][page] = loaded()
+
+    for row in at.dataframe[0].value.to_dict('records'):
+        if row['name'].startswith(('script.', 'page.')):
+            results[f"app.{row['name']}"] = {'count': row['count'], 'median_ms': row['p50_ms'], 'p95_ms': row['p95_ms']}
+    report(args, workdir, results)
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)['results']
+    with open(args.new) as f:
+        new = json.load(f)['results']
+    print(f"{'benchmark':<28}{'base ms':>12}{'new ms':>12}{'change':>10}")
+    for name in sorted(set(base) & set(new)):
+        if 'median_ms' not in base[name]:
+            continue
+        before, after = base[name]['median_ms'], new[name]['median_ms']
+        change = (after - before) / before * 100 if before else float('nan')
+        print(f"{name:<28}{before:>12.2f}{after:>12.2f}{change:>+9.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmark.py")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bench = commands.add_parser("run", help="Seed a scratch database and time the hot paths")
+    bench.add_argument("--scale", type=int, default=10000, help="papers and chats rows overall (1k to 1M)")
+    bench.add_argument("--workspaces", type=int, default=5, help="workspaces per user (one user per 1000 rows)")
+    bench.add_argument("--workspace-papers", type=int, default=200, help="real papers in the measured workspace")
+    bench.add_argument("--workspace-chats", type=int, default=2000, help="messages in the measured workspace")
+    bench.add_argument("--paper-words", type=int, default=2000)
+    bench.add_argument("--add-papers", type=int, default=50)
+    bench.add_argument("--pdf-pages", type=int, default=64)
+    bench.add_argument("--page-words", type=int, default=300)
+    bench.add_argument("--pdf-repeat", type=int, default=3)
+    bench.add_argument("--repeat", type=int, default=20)
+    bench.add_argument("--batch", type=int, default=10000, help="rows per insert transaction while seeding")
+    bench.add_argument("--seed", type=int, default=0)
+    bench.add_argument("--output", help="also write the JSON report here")
+    bench.add_argument("--workdir", help="keep the database here instead of a temporary directory")
+    bench.add_argument("--keep", action="store_true", help="do not delete the temporary directory")
+    bench.set_defaults(func=run)
+
+    boot = commands.add_parser("startup", help="Time the cold start and warm reruns of each page")
+    boot.add_argument("--repeat", type=int, default=10)
+    boot.add_argument("--output", help="also write the JSON report here")
+    boot.add_argument("--workdir", help="keep the database here instead of a temporary directory")
+    boot.add_argument("--keep", action="store_true", help="do not delete the temporary directory")
+    boot.set_defaults(func=startup)
+
+    diff = commands.add_parser("compare", help="Compare median timings of two reports")
+    diff.add_argument("base")
+    diff.add_argument("new")
+    diff.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
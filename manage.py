@@ -0,0 +1,65 @@
+import argparse
+import sys
+import time
+
+import app
+
+# Command-line maintenance tasks that run outside Streamlit, against the same
+# database (RESEARCHHUB_DB, default DB_FILE) the app uses.
+
+
+def load_arxiv(args):
+    app.init_db()
+    started = time.perf_counter()
+
+    def progress(path, loaded):
+        rate = loaded / max(time.perf_counter() - started, 1e-9)
+        print(f"\r{path}: {loaded:,} records ({rate:,.0f}/s)", end="", file=sys.stderr, flush=True)
+
+    loaded = app.load_arxiv_mirror(args.paths, batch_size=args.batch_size, progress=progress)
+    print(file=sys.stderr)
+    print(f"Loaded {loaded:,} records in {time.perf_counter() - started:.1f}s")
+
+
+def serve_db(args):
+    if not app.DB_TOKEN:
+        sys.exit("serve-db: set RESEARCHHUB_DB_TOKEN (replicas must use the same value)")
+    # Migrations run here, on the server's own file, before any replica
+    # connects; the replicas' init_db then finds the schema current.
+    conn = app.connect_sqlite(args.db)
+    try:
+        app.apply_migrations(conn)
+    finally:
+        conn.close()
+    server = app.DatabaseServer((args.host, args.port), args.db, max_clients=args.max_clients)
+    print(f"Serving {args.db} on researchhub://{args.host}:{server.server_address[1]}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="manage.py")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    load = commands.add_parser("load-arxiv", help="Bulk-load an arXiv metadata dump into the local mirror")
+    load.add_argument("paths", nargs="+", help="JSON lines (.jsonl/.json) or Atom XML files, optionally .gz")
+    load.add_argument("--batch-size", type=int, default=app.ARXIV_MIRROR_BATCH)
+    load.set_defaults(func=load_arxiv)
+
+    serve = commands.add_parser("serve-db", help="Share the database with app replicas over TCP")
+    serve.add_argument("--db", default=app.DB_FILE, help="SQLite file to serve")
+    serve.add_argument("--host", default="127.0.0.1", help="interface to bind; keep it private")
+    serve.add_argument("--port", type=int, default=app.DB_SERVER_PORT)
+    serve.add_argument("--max-clients", type=int, default=app.DB_SERVER_MAX_CLIENTS)
+    serve.set_defaults(func=serve_db)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
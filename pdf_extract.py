@@ -0,0 +1,70 @@
+import io
+import time
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import PyPDF2
+
+# Page-level PDF text extraction. Lives in its own module (not app.py) because
+# process-pool workers must be able to import the task function by name, and
+# Streamlit runs app.py as a synthetic __main__ that child processes cannot see.
+
+PAGES_PER_TASK = 16
+PARALLEL_MIN_PAGES = 32
+
+
+def count_pages(path):
+    with open(path, 'rb') as f:
+        return len(PyPDF2.PdfReader(f).pages)
+
+
+def extract_page_range(path, start, stop):
+    # One bad page must not lose the document: it yields empty text and the
+    # error is reported alongside its timing.
+    with open(path, 'rb') as f:
+        reader = PyPDF2.PdfReader(io.BytesIO(f.read()))
+    results = []
+    for number in range(start, stop):
+        began = time.perf_counter()
+        try:
+            text, error = reader.pages[number].extract_text() or "", None
+        except Exception as e:
+            text, error = "", f"{type(e).__name__}: {e}"
+        results.append((number, text, time.perf_counter() - began, error))
+    return results
+
+
+# Spreads page ranges over `executor` (a process pool) once the document is
+# long enough to be worth it and reassembles the text in page order. Returns
+# (text, stats) with one (page, seconds, chars, error) tuple per page and calls
+# progress(pages_done, pages_total) as ranges finish.
+def extract_pdf(path, executor=None, pages_per_task=PAGES_PER_TASK, progress=None):
+    total = count_pages(path)
+    if progress:
+        progress(0, total)
+
+    ranges = [(start, min(start + pages_per_task, total)) for start in range(0, total, pages_per_task)]
+    pages = {}
+
+    def collect(results):
+        for number, text, seconds, error in results:
+            pages[number] = (text, seconds, error)
+        if progress:
+            progress(len(pages), total)
+
+    if executor is None or total < PARALLEL_MIN_PAGES:
+        for start, stop in ranges:
+            collect(extract_page_range(path, start, stop))
+    else:
+        futures = {executor.submit(extract_page_range, path, start, stop): (start, stop) for start, stop in ranges}
+        for future in as_completed(futures):
+            try:
+                results = future.result()
+            except (BrokenProcessPool, OSError, EOFError):
+                # The worker died (e.g. killed for memory); redo its range here.
+                results = extract_page_range(path, *futures[future])
+            collect(results)
+
+    text = "\n".join(pages[n][0] for n in range(total))
+    stats = [(n, pages[n][1], len(pages[n][0]), pages[n][2]) for n in range(total)]
+    return text, stats
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+
+# A migrated database in a temporary directory holding one user and one
+# workspace; yields the workspace id.
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(app, "READ_CACHE", app.ReadCache(shared=False))
+    app.st.cache_resource.clear()
+    app.init_db()
+    with app.db_transaction() as conn:
+        user_id = conn.execute("INSERT INTO users (username, password) VALUES ('reader', '')").lastrowid
+        workspace_id = conn.execute("INSERT INTO workspaces (user_id, name) VALUES (?, 'papers')", (user_id,)).lastrowid
+    yield workspace_id
+    app.st.cache_resource.clear()
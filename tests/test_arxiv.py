@@ -0,0 +1,139 @@
+import http.server
+import io
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.parse
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+FEED_HEAD = ('<feed xmlns="http://www.w3.org/2005/Atom" xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/">'
+             '<opensearch:totalResults>{total}</opensearch:totalResults>')
+ENTRY = ('<entry><id>http://arxiv.org/abs/2101.{n:05d}v1</id><title>Paper {n}</title>'
+         '<summary>Abstract {n}.</summary><author><name>Author {n}</name></author></entry>')
+
+
+def feed(numbers, total=None):
+    entries = "".join(ENTRY.format(n=n) for n in numbers)
+    return (FEED_HEAD.format(total=len(numbers) if total is None else total) + entries + "</feed>").encode()
+
+
+def peak_parse_memory(count):
+    data = feed(range(count))
+    tracemalloc.start()
+    parsed = sum(1 for _ in app.iter_atom_entries(io.BytesIO(data)))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert parsed == count
+    return peak
+
+
+def test_iter_atom_entries_parses_entries_and_total():
+    meta = {}
+    entries = list(app.iter_atom_entries(io.BytesIO(feed([1, 2], total=40)), meta))
+    assert meta == {'total': 40}
+    assert [e['arxiv_id'] for e in entries] == ["2101.00001", "2101.00002"]
+    assert entries[0]['title'] == "Paper 1" and entries[0]['authors'] == "Author 1"
+
+
+def test_iter_atom_entries_memory_does_not_grow_with_the_feed():
+    assert peak_parse_memory(16000) < 2 * peak_parse_memory(2000)
+
+
+class StubArxiv(http.server.ThreadingHTTPServer):
+    # Serves `total` numbered entries, paged by start/max_results. Statuses
+    # queued in `failures` are answered (with their headers) before real pages.
+    def __init__(self, total):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.total = total
+        self.failures = []
+        self.requests = []
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        params = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        start, size = int(params['start'][0]), int(params['max_results'][0])
+        self.server.requests.append((start, size, time.monotonic()))
+        if self.server.failures:
+            status, headers = self.server.failures.pop(0)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = feed(range(start, min(start + size, self.server.total)), total=self.server.total)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/atom+xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = StubArxiv(total=95)
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(stub, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "ARXIV_PAGE_SIZE", 10)
+    monkeypatch.setattr(app, "ARXIV_BACKOFF", 0.01)
+    return app.ArxivClient(base_url=f"http://127.0.0.1:{stub.server_address[1]}/api/query",
+                           cache_dir=str(tmp_path / "cache"), min_interval=0)
+
+
+def test_search_pages_in_order(client, stub):
+    papers = client.search("graph  networks", max_results=35)
+
+    assert [p['title'] for p in papers] == [f"Paper {n}" for n in range(35)]
+    assert sorted((start, size) for start, size, _ in stub.requests) == [(0, 10), (10, 10), (20, 10), (30, 5)]
+
+
+def test_search_stops_at_the_reported_total(client, stub):
+    stub.total = 12
+    assert len(client.search("graph", max_results=50)) == 12
+    assert sorted(start for start, _, _ in stub.requests) == [0, 10]
+
+
+def test_retries_429_after_retry_after_and_5xx(client, stub):
+    stub.failures = [(429, {"Retry-After": "1"}), (503, {})]
+    papers, total = client.fetch_page("graph", 0, 10)
+
+    assert (len(papers), total) == (10, 95)
+    times = [t for _, _, t in stub.requests]
+    assert len(times) == 3
+    assert times[1] - times[0] >= 1.0
+
+
+def test_gives_up_after_the_retries(client, stub):
+    stub.failures = [(503, {})] * (app.ARXIV_RETRIES + 1)
+    with pytest.raises(app.ArxivError, match="HTTP 503"):
+        client.fetch_page("graph", 0, 10)
+    assert len(stub.requests) == app.ARXIV_RETRIES + 1
+
+
+def test_results_are_cached_until_the_ttl(client, stub):
+    first = client.search("Graph Networks", max_results=5)
+    assert client.search("graph   networks", max_results=5) == first
+    assert len(stub.requests) == 1
+
+    for name in os.listdir(client.cache.directory):
+        path = os.path.join(client.cache.directory, name)
+        os.utime(path, (time.time() - app.ARXIV_CACHE_TTL - 1,) * 2)
+    assert client.search("graph networks", max_results=5) == first
+    assert len(stub.requests) == 2
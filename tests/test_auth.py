@@ -0,0 +1,76 @@
+import hashlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+
+@pytest.fixture
+def users(workspace, monkeypatch):
+    # Cheap KDF settings; the format and the rehash rules are what is tested.
+    monkeypatch.setattr(app, "SCRYPT_N", 2 ** 8)
+    monkeypatch.setattr(app, "PBKDF2_ITERATIONS", 1000)
+
+
+def stored_password(username):
+    with app.get_pool().connection() as conn:
+        return conn.execute("SELECT password FROM users WHERE username = ?", (username,)).fetchone()[0]
+
+
+def set_password(username, stored):
+    with app.db_transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO users (id, username, password) VALUES ((SELECT id FROM users WHERE username = ?), ?, ?)",
+                     (username, username, stored))
+
+
+def test_legacy_sha256_hash_verifies_and_is_rehashed(users):
+    set_password("old", hashlib.sha256(b"hunter2").hexdigest())
+    user_id = app.authenticate_user("old", "hunter2")
+
+    assert user_id is not None
+    assert stored_password("old").startswith("scrypt$256$8$1$")
+    assert app.authenticate_user("old", "hunter2") == user_id
+    assert app.authenticate_user("old", "wrong") is None
+
+
+def test_cost_change_rehashes(users, monkeypatch):
+    assert app.register_user("carol", "pw")
+    before = stored_password("carol")
+    assert app.authenticate_user("carol", "pw") is not None
+    assert stored_password("carol") == before
+
+    monkeypatch.setattr(app, "SCRYPT_N", 2 ** 9)
+    assert app.authenticate_user("carol", "pw") is not None
+    assert stored_password("carol").startswith("scrypt$512$")
+
+
+def test_throttled_rehash_still_logs_in(users, monkeypatch):
+    set_password("old", hashlib.sha256(b"hunter2").hexdigest())
+
+    def saturated(password):
+        raise app.LoginThrottled("busy")
+
+    monkeypatch.setattr(app, "hash_password", saturated)
+    assert app.authenticate_user("old", "hunter2") is not None
+    assert "$" not in stored_password("old")
+
+
+def test_unknown_user_is_checked_against_the_dummy_hash(users, monkeypatch):
+    checked = []
+    check_password = app.check_password
+    monkeypatch.setattr(app, "check_password", lambda password, stored: checked.append(stored) or check_password(password, stored))
+
+    assert app.authenticate_user("nobody", "pw") is None
+    assert checked == [app.get_dummy_password_hash()]
+
+
+def test_repeated_failures_lock_the_username(users):
+    assert app.register_user("dave", "right")
+    for _ in range(app.LOGIN_FAILURE_LIMIT):
+        assert app.authenticate_user("dave", "wrong") is None
+    with pytest.raises(app.LoginThrottled):
+        app.authenticate_user("dave", "right")
+    assert app.authenticate_user("erin", "wrong") is None
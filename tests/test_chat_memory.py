@@ -0,0 +1,24 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+
+def message(n):
+    return f"Message {n} asks about sparse attention variant number {n}."
+
+
+def test_every_message_is_summarized_or_recent(workspace):
+    for n in range(1, 26):
+        app.save_chat(workspace, "user" if n % 2 else "assistant", message(n))
+        app.update_chat_summary(workspace)
+        summary, recent = app.get_chat_memory(workspace)
+        seen = summary + "\n" + "\n".join(m.content for m in recent)
+        assert all(message(i) in seen for i in range(1, n + 1)), n
+
+    # The fold ran (25 messages leave 19 outside the verbatim window) and
+    # recent starts right after what it covers.
+    summary, recent = app.get_chat_memory(workspace)
+    assert message(10) in summary
+    assert [m.content for m in recent] == [message(i) for i in range(11, 26)]
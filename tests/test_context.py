@@ -0,0 +1,22 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+WORDS = "retrieval budget tokens attention transformer context window latency".split()
+
+
+def test_context_fits_budget_with_every_paper(workspace):
+    for n in range(8):
+        body = " ".join(WORDS[(n + i) % len(WORDS)] for i in range(1200))
+        app.add_paper(workspace, f"Paper {n} on long context retrieval", "", "", body, f"local:{n}")
+    papers = app.get_papers(workspace, columns=("id", "title"))
+    budget = 3000
+
+    context = app.build_context("attention budget for long context", papers, budget)
+    clipped, _ = app.clip_to_tokens(context, budget)
+
+    assert app.estimate_tokens(context) <= budget
+    assert clipped == context
+    assert context.count("Title: ") == 8
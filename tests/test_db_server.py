@@ -0,0 +1,80 @@
+import os
+import sqlite3
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+TOKEN = "s3cret"
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = app.DatabaseServer(("127.0.0.1", 0), db_file=str(tmp_path / "served.db"), token=TOKEN)
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server.server_address
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def remote(server):
+    conn = app.RemoteConnection(server, token=TOKEN)
+    yield conn
+    conn.close()
+
+
+def test_parse_db_url():
+    assert app.parse_db_url("researchhub://dbhost") == ("dbhost", app.DB_SERVER_PORT)
+    assert app.parse_db_url("researchhub://dbhost:9000/") == ("dbhost", 9000)
+    assert app.parse_db_url("researchhub://[::1]:9000") == ("::1", 9000)
+    assert app.parse_db_url("researchhub://") == ("127.0.0.1", app.DB_SERVER_PORT)
+    assert app.parse_db_url("researchhub.db") is None
+    assert app.parse_db_url("/var/lib/researchhub/researchhub.db") is None
+
+
+def test_execute_and_blob_round_trip(remote):
+    blob = bytes(range(256))
+    with remote:
+        remote.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT UNIQUE, data BLOB)")
+        cur = remote.execute("INSERT INTO t (name, data) VALUES (?, ?)", ("a", blob))
+        assert (cur.lastrowid, cur.rowcount) == (1, 1)
+        cur = remote.executemany("INSERT INTO t (name, data) VALUES (:name, :data)", [{'name': "b", 'data': b""}, {'name': "c", 'data': None}])
+        assert cur.rowcount == 2
+    assert remote.execute("SELECT name, data FROM t ORDER BY id").fetchall() == [("a", blob), ("b", b""), ("c", None)]
+    assert remote.execute("SELECT COUNT(*) FROM t").fetchone() == (3,)
+
+
+def test_transactions_and_error_classes(remote):
+    remote.execute("CREATE TABLE t (name TEXT UNIQUE)")
+    remote.commit()
+    with pytest.raises(sqlite3.IntegrityError):
+        with remote:
+            remote.execute("INSERT INTO t VALUES ('a')")
+            assert remote.in_transaction
+            remote.execute("INSERT INTO t VALUES ('a')")
+    assert not remote.in_transaction
+    assert remote.execute("SELECT COUNT(*) FROM t").fetchone() == (0,)
+    with pytest.raises(sqlite3.OperationalError):
+        remote.execute("SELECT * FROM missing")
+
+
+@pytest.mark.parametrize("token", ["wrong", "", None])
+def test_bad_or_empty_token_is_refused(server, token):
+    with pytest.raises(sqlite3.OperationalError, match="bad database token"):
+        app.RemoteConnection(server, token=token)
+
+
+def test_server_requires_a_token(tmp_path):
+    with pytest.raises(ValueError):
+        app.DatabaseServer(("127.0.0.1", 0), db_file=str(tmp_path / "served.db"), token="")
+
+
+def test_attach_is_denied(remote, tmp_path):
+    with pytest.raises(sqlite3.DatabaseError, match="not authorized"):
+        remote.execute("ATTACH DATABASE ? AS other", (str(tmp_path / "other.db"),))
+    assert not (tmp_path / "other.db").exists()
@@ -0,0 +1,48 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+
+def add_job(workspace, status, age_seconds):
+    with app.db_transaction() as conn:
+        return conn.execute(
+            "INSERT INTO ingest_jobs (user_id, workspace_id, filename, status, updated_at) VALUES (1, ?, 'a.pdf', ?, datetime('now', ?))",
+            (workspace, status, f"-{age_seconds} seconds"),
+        ).lastrowid
+
+
+def statuses():
+    with app.get_pool().connection() as conn:
+        return dict(conn.execute("SELECT id, status FROM ingest_jobs"))
+
+
+def test_stale_running_jobs_are_requeued_after_startup(workspace, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(app, "run_ingest_job", lambda job_id, api_key=None: submitted.append(job_id))
+    # Left running by a process that crashed a moment ago: too fresh at startup.
+    lost = add_job(workspace, "running", 10)
+    app.get_ingest_executor()
+    assert statuses()[lost] == "running"
+
+    with app.db_transaction() as conn:
+        conn.execute("UPDATE ingest_jobs SET updated_at = datetime('now', ?) WHERE id = ?", (f"-{app.INGEST_STALE_SECONDS + 1} seconds", lost))
+    active = add_job(workspace, "running", 10)
+    assert [j['stale'] for j in app.get_ingest_jobs(workspace)] == [False, True]
+    assert app.requeue_stale_ingest_jobs() == [lost]
+    app.get_ingest_executor().shutdown(wait=True)
+
+    assert submitted == [lost]
+    assert statuses() == {lost: "queued", active: "running"}
+
+
+def test_retry_accepts_failed_and_stale_jobs(workspace, monkeypatch):
+    monkeypatch.setattr(app, "run_ingest_job", lambda job_id, api_key=None: None)
+    app.get_ingest_executor()
+    failed = add_job(workspace, "failed", 10)
+    stale = add_job(workspace, "running", app.INGEST_STALE_SECONDS + 1)
+    active = add_job(workspace, "running", 10)
+    for job_id in (failed, stale, active):
+        app.retry_ingest_job(job_id)
+    assert statuses() == {failed: "queued", stale: "queued", active: "running"}
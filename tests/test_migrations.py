@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+# The schema init_db created before versioned migrations existed.
+BASELINE_SCHEMA = '''
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE workspaces (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    name TEXT NOT NULL,
+    description TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (id)
+);
+CREATE TABLE papers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    workspace_id INTEGER,
+    title TEXT NOT NULL,
+    authors TEXT,
+    abstract TEXT,
+    content TEXT,
+    source TEXT,
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (workspace_id) REFERENCES workspaces (id)
+);
+CREATE TABLE chats (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    workspace_id INTEGER,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (workspace_id) REFERENCES workspaces (id)
+);
+CREATE TABLE docs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    title TEXT NOT NULL,
+    content TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (id)
+);
+'''
+
+LOCAL_TEXT = "Graph neural networks for protein folding. " * 40
+WITHDRAWN = "This paper has been withdrawn by the author due to an error in the proof."
+PAPERS = [
+    # id, workspace, title, content, source
+    (1, 1, "Local paper", LOCAL_TEXT, "Local"),
+    (2, 1, "Local paper again", LOCAL_TEXT, "Local"),  # same workspace: deduplicated
+    (3, 2, "Local paper elsewhere", LOCAL_TEXT, "Local"),  # other workspace: shares the body
+    (4, 1, "Withdrawn A", WITHDRAWN, "http://arxiv.org/abs/1501.00001v2"),
+    (5, 1, "Withdrawn B", WITHDRAWN, "http://arxiv.org/abs/1607.09999v1"),
+]
+
+
+@pytest.fixture
+def baseline_db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "baseline.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.execute("INSERT INTO users (username, password) VALUES ('alice', 'x')")
+    conn.executemany("INSERT INTO workspaces (user_id, name) VALUES (1, ?)", [("One",), ("Two",)])
+    conn.executemany(
+        "INSERT INTO papers (id, workspace_id, title, authors, abstract, content, source) VALUES (?, ?, ?, 'A. Author', ?, ?, ?)",
+        [(i, ws, title, content[:200], content, source) for i, ws, title, content, source in PAPERS],
+    )
+    # Old releases stored workspace ids taken from DataFrames as int64 BLOBs.
+    conn.execute("INSERT INTO chats (workspace_id, role, content) VALUES (?, 'user', 'hello')", (np.int64(1).tobytes(),))
+    conn.execute("INSERT INTO chats (workspace_id, role, content) VALUES (2, 'assistant', 'hi')")
+    conn.execute("INSERT INTO docs (user_id, title, content) VALUES (1, 'Notes', 'draft')")
+    conn.commit()
+    conn.close()
+    conn = app.connect_sqlite(path)
+    yield conn
+    conn.close()
+
+
+def paper_bodies(conn):
+    return dict(conn.execute("SELECT id, body_id FROM papers"))
+
+
+def test_migrates_baseline_schema(baseline_db):
+    conn = baseline_db
+    app.apply_migrations(conn)
+
+    assert app.schema_version(conn) == app.MIGRATIONS[-1][0]
+    assert conn.execute("SELECT username FROM users").fetchall() == [("alice",)]
+    assert conn.execute("SELECT title, content FROM docs").fetchall() == [("Notes", "draft")]
+    assert conn.execute("SELECT workspace_id, typeof(workspace_id) FROM chats ORDER BY id").fetchall() == [
+        (1, "integer"), (2, "integer"),
+    ]
+
+    bodies = paper_bodies(conn)
+    assert set(bodies) == {1, 3, 4, 5}
+    assert bodies[1] == bodies[3]
+    assert bodies[4] != bodies[5]
+    arxiv = dict(conn.execute("SELECT id, arxiv_id FROM paper_bodies"))
+    assert arxiv[bodies[4]] == "1501.00001" and arxiv[bodies[5]] == "1607.09999"
+
+    content = dict(conn.execute("SELECT id, content_z FROM paper_bodies"))
+    assert app.decompress_text(content[bodies[1]]) == LOCAL_TEXT
+    assert app.decompress_text(content[bodies[5]]) == WITHDRAWN
+    for body_id in set(bodies.values()):
+        assert conn.execute("SELECT COUNT(*) FROM body_chunks WHERE body_id = ?", (body_id,)).fetchone()[0] > 0
+
+    hits = {r[0] for r in conn.execute("SELECT rowid FROM papers_fts WHERE papers_fts MATCH 'withdrawn'")}
+    assert hits == {4, 5}
+
+    # A second run is a no-op.
+    app.apply_migrations(conn)
+    assert paper_bodies(conn) == bodies
+
+
+def test_store_body_keys_arxiv_by_id(baseline_db):
+    conn = baseline_db
+    app.apply_migrations(conn)
+    with conn:
+        first = app.store_body(conn, "A", WITHDRAWN, WITHDRAWN, "http://arxiv.org/abs/2001.00001v1")
+        second = app.store_body(conn, "B", WITHDRAWN, WITHDRAWN, "http://arxiv.org/abs/2001.00002v1")
+        revised = app.store_body(conn, "A", "new abstract", "new abstract", "http://arxiv.org/abs/2001.00001v3")
+        local = app.store_body(conn, "L", "", LOCAL_TEXT, "Local")
+    assert first != second
+    assert revised == first
+    assert local == paper_bodies(conn)[1]
@@ -0,0 +1,31 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+
+def test_concurrent_imports_of_the_same_papers(workspace):
+    threads, errors, results = 4, [], []
+    barrier = threading.Barrier(threads)
+
+    def run():
+        barrier.wait()
+        try:
+            results.append([app.add_paper(workspace, f"Paper {n}", "", "", f"Shared text number {n}. " * 40, f"local:{n}")
+                            for n in range(15)])
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    assert errors == []
+    assert all(ids == results[0] for ids in results)
+    with app.get_pool().connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM papers").fetchone()[0] == 15
+        assert conn.execute("SELECT COUNT(*) FROM paper_bodies").fetchone()[0] == 15
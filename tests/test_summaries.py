@@ -0,0 +1,50 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+
+def test_extractive_summary_caps_unpunctuated_text():
+    text = " ".join(f"cell{i} value{i}" for i in range(3000))
+    summary, insights = app.extractive_summary(text)
+
+    assert len(summary) <= app.SUMMARY_MAX_CHARS
+    assert all(len(i) <= app.SUMMARY_SENTENCE_CHARS for i in insights)
+
+
+def test_extractive_summaries_are_redone_with_a_key(workspace, monkeypatch):
+    body = "Sparse attention cuts the cost of long inputs. " * 20
+    paper_id = app.add_paper(workspace, "Sparse attention", "", "", body, "local:sparse")
+    app.summarize_papers([paper_id])
+    assert app.get_paper_summaries([paper_id])[paper_id]['model'] == "extractive"
+
+    calls = []
+
+    def complete_batch(batch, api_key):
+        calls.append(len(batch))
+        return [json.dumps({"summary": "Model summary.", "insights": ["One."]})] * len(batch)
+
+    monkeypatch.setattr(app, "complete_batch", complete_batch)
+    summaries = app.ensure_paper_summaries([paper_id], api_key="key")
+
+    assert calls == [1]
+    assert summaries[paper_id]['model'] == app.GROQ_MODEL
+    assert summaries[paper_id]['summary'] == "Model summary."
+    app.ensure_paper_summaries([paper_id], api_key="key")
+    assert calls == [1]
+
+
+def test_background_failures_are_logged_and_counted(workspace, monkeypatch, caplog):
+    def broken(paper_ids, api_key=None):
+        raise RuntimeError("model exploded")
+
+    monkeypatch.setattr(app, "summarize_papers", broken)
+    future = app.enqueue_paper_pipeline(1)
+    assert isinstance(future.exception(timeout=5), RuntimeError)
+    app.get_pipeline_executor().shutdown(wait=True)
+
+    assert "background task process_paper failed" in caplog.text
+    assert "model exploded" in caplog.text
+    assert [r['count'] for r in app.METRICS.snapshot() if r['name'] == "failed.process_paper"] == [1]
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+
+def unit_vectors(n, dim=8):
+    return app.normalize_rows(np.random.default_rng(n).standard_normal((n, dim)).astype(np.float32))
+
+
+def test_delete_tombstones_then_compacts(tmp_path):
+    index = app.VectorIndex(str(tmp_path / "ws"), dim=8)
+    vectors = unit_vectors(8)
+    index.append(np.arange(1, 9), vectors)
+
+    # One of eight rows is below VECTOR_COMPACT_RATIO: the row stays as -1.
+    index.delete([3])
+    assert np.fromfile(index.ids_path, dtype=np.int64).tolist() == [1, 2, -1, 4, 5, 6, 7, 8]
+    assert 3 not in index.live_ids()
+    assert all(i != 3 for i, _ in index.search(vectors[2], k=8)[0])
+
+    # The second tombstone reaches the ratio and the files are rewritten.
+    index.delete([5])
+    assert np.fromfile(index.ids_path, dtype=np.int64).tolist() == [1, 2, 4, 6, 7, 8]
+    assert os.path.getsize(index.vectors_path) == 6 * 8 * 4
+    ids, kept = index.vectors_for([4, 8])
+    assert ids.tolist() == [4, 8]
+    assert np.allclose(kept, vectors[[3, 7]])
+
+
+def test_delete_paper_drops_it_from_the_index(workspace):
+    ids = [app.add_paper(workspace, f"Paper {n}", "", "", f"Notes on topic {n}. " * 30, f"local:{n}") for n in range(3)]
+    app.delete_paper(workspace, ids[1])
+
+    assert [p.id for p in app.get_papers(workspace, columns=("id",))] == [ids[0], ids[2]]
+    assert sorted(app.get_vector_index(workspace).live_ids().tolist()) == [ids[0], ids[2]]
+    assert [r['paper_id'] for r in app.related_papers(workspace, [ids[0]])[ids[0]]] == [ids[2]]